@@ -0,0 +1,349 @@
+"""Offline benchmarks for the bot.
+
+Loads the real cogs into a bot running on a :class:`FakeGateway` (so no Discord connection is needed), drives scripted
+workloads through the normal command handling path and reports ops/sec, latency percentiles and peak memory as JSON.
+
+Run ``python bench.py --help`` for usage. Pass ``--compare`` with the output of an earlier run to see how each
+workload changed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from embedhelp import EmbedHelpCommand
+from fakegateway import FakeGateway
+from leobot import LeoBot
+from replies import ReplyPipeline
+
+BENCH_EXTENSIONS = ['cogs.system', 'cogs.userdata', 'cogs.economy', 'cogs.gambling']
+# base of the fake users' and guilds' IDs: they have to look like real snowflakes for the converters to accept them
+SNOWFLAKE_BASE = 2 * 10 ** 17
+
+Result = Dict[str, Any]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """
+    :param sorted_values: values, sorted in ascending order
+    :param q: quantile, between 0 and 1
+    :return: the value at the quantile
+    """
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def max_rss() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux, but in bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def snowflake(n: int) -> int:
+    return SNOWFLAKE_BASE + n
+
+
+def summarize(latencies: List[float], elapsed: float) -> Result:
+    """
+    Summarizes the latencies of a workload's operations.
+
+    :param latencies: latency (in seconds) of each operation
+    :param elapsed: total time (in seconds) the workload took
+    :return: summary
+    """
+    latencies = sorted(latencies)
+    return dict(ops=len(latencies),
+                seconds=elapsed,
+                ops_per_sec=len(latencies) / elapsed if elapsed > 0 else 0.0,
+                latency_ms=dict(p50=percentile(latencies, 0.5) * 1000,
+                                p90=percentile(latencies, 0.9) * 1000,
+                                p99=percentile(latencies, 0.99) * 1000,
+                                max=(latencies[-1] if len(latencies) > 0 else 0.0) * 1000))
+
+
+def create_bench_bot(api_latency: float = 0.0) -> Tuple[LeoBot, FakeGateway]:
+    """
+    Creates a bot running on a fake gateway, with the benchmarked extensions loaded.
+
+    :param api_latency: simulated time (in seconds) an API call takes
+    :return: the bot and its gateway
+    """
+    bot = LeoBot(command_prefix='!', help_command=EmbedHelpCommand())
+    # replies aren't rate limited offline
+    bot.replies = ReplyPipeline(rate=sys.maxsize)
+    gateway = FakeGateway(bot, api_latency=api_latency)
+    gateway.install()
+    for ext in BENCH_EXTENSIONS:
+        bot.load_extension(ext)
+    return bot, gateway
+
+
+def seed_accounts(bot: LeoBot, members: Iterable[Any], credits: int) -> int:
+    """
+    Gives users a credits account directly in the userdata cache, so the economy workloads measure the commands that
+    use accounts.
+
+    :param bot: the bot
+    :param members: users to give an account
+    :param credits: balance of each account
+    :return: total balance of the accounts
+    """
+    userdata = bot.get_cog('UserData')
+    economy = bot.get_cog('Economy')
+    total = 0
+    for member in members:
+        # a store's first load returns the cached store itself
+        userdata.userdata_load(None, member)['economy'] = dict(credits=credits)
+        if not economy.credits_has_account(member):
+            raise RuntimeError(f'Failed to seed the account of {member}')
+        total += credits
+    return total
+
+
+def reply_kinds(messages: Iterable[Any]) -> Counter:
+    """
+    :param messages: replies of the bot
+    :return: amount of replies with each text (or embed title), up to the first bold part
+    """
+    kinds = Counter()
+    for message in messages:
+        text = str(message.embeds[0].title) if len(message.embeds) > 0 else message.content
+        kinds[text.split('**', 1)[0]] += 1
+    return kinds
+
+
+def check_economy(bot: LeoBot, members: Iterable[Any], replies: Counter, expected: Dict[str, int],
+                  expected_total: int):
+    """
+    Checks that the economy commands did what they were supposed to, so a broken path fails the benchmark instead of
+    measuring a no-op.
+
+    :param bot: the bot
+    :param members: users of the workload
+    :param replies: replies of the bot, from :func:`reply_kinds`
+    :param expected: reply -> amount of times it was expected
+    :param expected_total: expected total balance of the users' accounts
+    :raises RuntimeError: if the replies or the balances aren't as expected
+    """
+    for reply, count in expected.items():
+        if replies[reply] != count:
+            raise RuntimeError(f'Expected {count} "{reply}" replies, got {replies[reply]} (replies: {dict(replies)})')
+    economy = bot.get_cog('Economy')
+    total = sum(economy.credits_get(member, False) or 0 for member in members)
+    if total != expected_total:
+        raise RuntimeError(f'Expected a total balance of {expected_total}, got {total}')
+
+
+async def _timed(latencies: List[float], func: Callable, *args):
+    start = time.perf_counter()
+    await func(*args)
+    latencies.append(time.perf_counter() - start)
+
+
+async def bench_economy(bot: LeoBot, gateway: FakeGateway, users: int, rounds: int) -> Result:
+    """
+    Has users with accounts try to create one, then repeatedly redeem paydays, check their balance and transfer
+    credits to each other.
+    """
+    guild = gateway.guild(snowflake(1000))
+    channel = gateway.channel(guild, history=None)
+    members = [gateway.user(snowflake(10000 + i)) for i in range(users)]
+    seeded = seed_accounts(bot, members, max(1000, rounds))
+    rng = random.Random(0)
+    latencies = []
+    start = time.perf_counter()
+    for member in members:
+        await _timed(latencies, gateway.send_message, member, channel, '!account-create')
+    for _ in range(rounds):
+        for member in members:
+            target = rng.choice(members)
+            await _timed(latencies, gateway.send_message, member, channel, '!payday')
+            await _timed(latencies, gateway.send_message, member, channel, '!balance')
+            await _timed(latencies, gateway.send_message, member, channel, f'!transfer {target.id} 1')
+    result = summarize(latencies, time.perf_counter() - start)
+    # only the first payday of each user pays out
+    check_economy(bot, members, reply_kinds(channel.sent),
+                  {'You already have an account!': users, 'Payday redeemed!': users if rounds > 0 else 0,
+                   'You have ': users * rounds, 'Sent ': users * rounds}, seeded + (500 * users if rounds > 0 else 0))
+    return result
+
+
+async def bench_economy_concurrent(bot: LeoBot, gateway: FakeGateway, users: int, rounds: int) -> Result:
+    """Like :func:`bench_economy`, but every user's commands run concurrently."""
+    guild = gateway.guild(snowflake(1001))
+    channel = gateway.channel(guild, history=None)
+    members = [gateway.user(snowflake(20000 + i)) for i in range(users)]
+    seeded = seed_accounts(bot, members, max(1000, rounds))
+    latencies = []
+
+    async def session(member, rng):
+        await _timed(latencies, gateway.send_message, member, channel, '!account-create')
+        for _ in range(rounds):
+            await _timed(latencies, gateway.send_message, member, channel, '!balance')
+            await _timed(latencies, gateway.send_message, member, channel,
+                         f'!transfer {rng.choice(members).id} 1')
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(member, random.Random(i)) for i, member in enumerate(members)))
+    result = summarize(latencies, time.perf_counter() - start)
+    check_economy(bot, members, reply_kinds(channel.sent),
+                  {'You already have an account!': users, 'You have ': users * rounds, 'Sent ': users * rounds}, seeded)
+    return result
+
+
+async def bench_flush(bot: LeoBot, gateway: FakeGateway, stores: int, guilds: int, cycles: int) -> Result:
+    """Fills the userdata and config caches, then times full flushes of them."""
+    userdata = bot.get_cog('UserData')
+    system = bot.get_cog('System')
+    fake_guilds = [gateway.guild(snowflake(30000 + i)) for i in range(guilds)]
+    for i in range(stores):
+        u_dict = userdata.userdata_load(fake_guilds[i % guilds], gateway.user(snowflake(40000 + i)))
+        u_dict['economy'] = dict(credits=i, last_payday='2020-01-01T00:00:00+00:00')
+    for guild in fake_guilds:
+        system.config_load(guild)['bench'] = True
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(cycles):
+        flush_start = time.perf_counter()
+        userdata.userdata_flush()
+        system.config_flush()
+        latencies.append(time.perf_counter() - flush_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def bench_help(bot: LeoBot, gateway: FakeGateway, iterations: int) -> Result:
+    """Renders the bot, cog and command help, both for the owner in DMs and for a regular user in a guild."""
+    owner = gateway.user(gateway.owner_id)
+    owner_dm = gateway.dm_channel(owner)
+    member = gateway.user(snowflake(50000))
+    channel = gateway.channel(gateway.guild(snowflake(1002)))
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for author, where in ((owner, owner_dm), (member, channel)):
+            await _timed(latencies, gateway.send_message, author, where, '!help')
+            await _timed(latencies, gateway.send_message, author, where, '!help Economy')
+            await _timed(latencies, gateway.send_message, author, where, '!help balance')
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run_benchmarks(bot: LeoBot, gateway: FakeGateway, args: argparse.Namespace) -> Dict[str, Result]:
+    workloads = dict(
+        economy=lambda: bench_economy(bot, gateway, args.users, args.rounds),
+        economy_concurrent=lambda: bench_economy_concurrent(bot, gateway, args.users, args.rounds),
+        flush=lambda: bench_flush(bot, gateway, args.stores, args.guilds, args.cycles),
+        help=lambda: bench_help(bot, gateway, args.help_iterations),
+    )
+    results = dict()
+    for name, workload in workloads.items():
+        if args.only is not None and name not in args.only:
+            continue
+        errors = bot.metrics.counter_total('leobot_command_errors_total')
+        if args.memory:
+            tracemalloc.start()
+        result = await workload()
+        if args.memory:
+            result['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        result['max_rss_bytes'] = max_rss()
+        # let error replies and other scheduled events finish before the next workload
+        await asyncio.sleep(0)
+        errors = bot.metrics.counter_total('leobot_command_errors_total') - errors
+        if errors > 0:
+            # a workload whose commands fail measures error handling, not the commands
+            raise RuntimeError(f'{name}: {int(errors)} commands failed')
+        results[name] = result
+        print(f'{name}: {result["ops_per_sec"]:.1f} ops/sec, p99 {result["latency_ms"]["p99"]:.3f} ms',
+              file=sys.stderr)
+    return results
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """
+    Compares two benchmark runs.
+
+    :param baseline: output of the earlier run
+    :param current: output of the later run
+    :return: lines describing the change in each workload both runs have
+    """
+    lines = []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        ops_change = (result['ops_per_sec'] / old['ops_per_sec'] - 1) if old['ops_per_sec'] > 0 else 0.0
+        p99_change = (result['latency_ms']['p99'] / old['latency_ms']['p99'] - 1) \
+            if old['latency_ms']['p99'] > 0 else 0.0
+        lines.append(f'{name}: ops/sec {ops_change:+.1%}, p99 latency {p99_change:+.1%}')
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Runs offline benchmarks of the bot\'s cogs.')
+    parser.add_argument('--users', type=int, default=200, help='users in the economy workloads (default: 200)')
+    parser.add_argument('--rounds', type=int, default=5, help='rounds of the economy workloads (default: 5)')
+    parser.add_argument('--stores', type=int, default=10000, help='cached stores in the flush workload '
+                                                                  '(default: 10000)')
+    parser.add_argument('--guilds', type=int, default=50, help='guilds in the flush workload (default: 50)')
+    parser.add_argument('--cycles', type=int, default=3, help='flush cycles in the flush workload (default: 3)')
+    parser.add_argument('--help-iterations', type=int, default=50, help='iterations of the help workload '
+                                                                        '(default: 50)')
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='simulated time (in seconds) an API call takes (default: 0)')
+    parser.add_argument('--only', nargs='+', default=None, help='only run these workloads')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace allocations to report each workload\'s peak memory (slows workloads down)')
+    parser.add_argument('--output', default=None, help='file to write results to (default: stdout)')
+    parser.add_argument('--compare', default=None, help='results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='leobot-bench-')
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)
+    os.makedirs('configs', exist_ok=True)
+    try:
+        bot, gateway = create_bench_bot(args.api_latency)
+        try:
+            results = bot.loop.run_until_complete(run_benchmarks(bot, gateway, args))
+        finally:
+            for ext in reversed(list(bot.extensions)):
+                bot.unload_extension(ext)
+            bot.loop.run_until_complete(bot.close())
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = dict(meta=dict(python=platform.python_version(),
+                            platform=platform.platform(),
+                            time=time.time(),
+                            args=vars(args),
+                            api_calls=gateway.api_calls),
+                  results=results)
+    text = json.dumps(output, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        f = open(args.output, 'w')
+        f.write(text)
+        f.close()
+    if args.compare is not None:
+        f = open(args.compare, 'r')
+        baseline = json.load(f)
+        f.close()
+        for line in compare(baseline, output):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
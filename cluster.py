@@ -0,0 +1,208 @@
+"""Runs the bot as a cluster of worker processes, each handling its own range of shards.
+
+Every worker runs its own event loop and keeps its own caches. Guild-scoped data is only ever touched by the worker
+handling that guild's shard, while global data (like the credits service's accounts) lives in a :class:`SharedStore`
+that all workers use. The launcher process relays broadcasts between workers, so owner commands like ``sys exit`` and
+``sys exts load`` apply to the whole cluster.
+
+Run ``python cluster.py --help`` for usage. With ``--fake-gateway``, workers don't connect to Discord, and broadcasts
+can be typed into the launcher's console (for example ``exts_load cogs.gambling`` or ``exit``).
+"""
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import threading
+from multiprocessing.connection import Connection, wait
+from queue import Queue, Empty
+from typing import Any, List, Optional
+
+import discord
+from discord.ext import commands
+
+from sharedstore import SharedStore
+
+
+class ClusterClient:
+    """Connects a worker's bot to the rest of the cluster.
+
+    Broadcasts received from other workers are dispatched to the bot as ``cluster_message`` events, with the operation
+    and its payload as arguments.
+    """
+
+    def __init__(self, bot: commands.Bot, worker_id: int, worker_count: int, conn: Connection, store: SharedStore):
+        """
+        :param bot: this worker's bot
+        :param worker_id: ID of this worker
+        :param worker_count: amount of workers in the cluster
+        :param conn: connection to the launcher
+        :param store: store for global data
+        """
+        self.bot = bot
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+        self.store = store
+        self._conn = conn
+        self._send_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        bot.cluster = self
+
+    def start(self):
+        """Starts listening for broadcasts from other workers, and keeping the shared store's leases."""
+        self._thread = threading.Thread(target=self._receive, name='ClusterClient', daemon=True)
+        self._thread.start()
+        self.bot.loop.create_task(self.store.renew_leases())
+        self.bot.before_invoke(self._acquire_stores)
+
+    async def _acquire_stores(self, ctx: commands.Context):
+        # acquires the global data of the users a command is about to use, so the command doesn't block loading it
+        users = [ctx.author] + [arg for arg in list(ctx.args) + list(ctx.kwargs.values())
+                                if isinstance(arg, discord.abc.User)]
+        await self.store.acquire(('_GLOBAL', str(user.id)) for user in users)
+
+    def _receive(self):
+        while True:
+            try:
+                op, payload = self._conn.recv()
+            except (EOFError, OSError):
+                return
+            self.bot.loop.call_soon_threadsafe(self.bot.dispatch, 'cluster_message', op, payload)
+
+    def broadcast(self, op: str, payload: Any = None):
+        """
+        Sends an operation to every other worker in the cluster.
+
+        :param op: operation name
+        :param payload: operation payload. must be picklable
+        """
+        with self._send_lock:
+            self._conn.send((op, payload))
+
+
+def shard_ranges(shard_count: int, worker_count: int) -> List[List[int]]:
+    """
+    Splits shards as evenly as possible between workers.
+
+    :param shard_count: total amount of shards
+    :param worker_count: amount of workers
+    :return: list of shard IDs for each worker
+    """
+    return [list(range(shard_count))[i::worker_count] for i in range(worker_count)]
+
+
+def _worker_main(worker_id: int, worker_count: int, shard_ids: List[int], shard_count: int, conn: Connection,
+                 store_file: str, fake_gateway: bool):
+    import leobot
+    bot = leobot.create_bot(shard_ids=shard_ids, shard_count=shard_count)
+    store = SharedStore(store_file, worker_id)
+    client = ClusterClient(bot, worker_id, worker_count, conn, store)
+    if fake_gateway:
+        from fakegateway import FakeGateway
+        FakeGateway(bot).install()
+        token = 'fake'
+    else:
+        token = leobot.read_token()
+    print(f'Worker {worker_id} handling shards {shard_ids} (of {shard_count})')
+    client.start()
+    try:
+        bot.run(token)
+    finally:
+        store.close()
+        conn.close()
+
+
+async def _recommended_shards(token: str) -> int:
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(token.strip(), bot=True)
+        shards, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shards
+
+
+def _read_console(queue: Queue):
+    for line in sys.stdin:
+        parts = line.split()
+        if len(parts) > 0:
+            queue.put((parts[0], parts[1:]))
+
+
+def run_cluster(worker_count: int, shard_count: int, store_file: str, fake_gateway: bool = False):
+    """
+    Starts the workers of a cluster and relays broadcasts between them until they have all exited.
+
+    :param worker_count: amount of workers
+    :param shard_count: total amount of shards
+    :param store_file: SQLite database file for global data
+    :param fake_gateway: if True, workers run without connecting to Discord
+    """
+    ctx = multiprocessing.get_context('spawn')
+    conns = []
+    processes = []
+    for worker_id, shard_ids in enumerate(shard_ranges(shard_count, worker_count)):
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=_worker_main, name=f'LeoBot-{worker_id}',
+                              args=(worker_id, worker_count, shard_ids, shard_count, child_conn, store_file,
+                                    fake_gateway))
+        process.start()
+        child_conn.close()
+        conns.append(parent_conn)
+        processes.append(process)
+
+    console = Queue()
+    threading.Thread(target=_read_console, args=(console,), name='ClusterConsole', daemon=True).start()
+    live = list(conns)
+
+    def drop(conn: Connection):
+        if conn in live:
+            live.remove(conn)
+            worker_id = conns.index(conn)
+            print(f'Lost connection to worker {worker_id}, no longer relaying broadcasts to it.', file=sys.stderr)
+
+    def send_all(message: Any, sender: Optional[Connection] = None):
+        for other in list(live):
+            if other is sender:
+                continue
+            try:
+                other.send(message)
+            except (BrokenPipeError, EOFError, OSError):
+                drop(other)
+
+    while len(live) > 0:
+        for conn in wait(live, timeout=0.5):
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                drop(conn)
+                continue
+            send_all(message, conn)
+        try:
+            op, payload = console.get_nowait()
+        except Empty:
+            pass
+        else:
+            send_all((op, payload))
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the bot as a cluster of worker processes.')
+    parser.add_argument('--workers', type=int, default=2, help='amount of worker processes (default: 2)')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='total amount of shards (default: as many as Discord recommends, or 1 per worker with '
+                             '--fake-gateway)')
+    parser.add_argument('--store', default='userdata/_GLOBAL.sqlite3',
+                        help='SQLite database file for global data (default: userdata/_GLOBAL.sqlite3)')
+    parser.add_argument('--fake-gateway', action='store_true',
+                        help='run workers without connecting to Discord, for local testing')
+    args = parser.parse_args()
+    shards = args.shards
+    if shards is None:
+        if args.fake_gateway:
+            shards = args.workers
+        else:
+            import leobot
+            shards = asyncio.get_event_loop().run_until_complete(_recommended_shards(leobot.read_token()))
+    run_cluster(args.workers, max(shards, args.workers), args.store, args.fake_gateway)
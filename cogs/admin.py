@@ -3,6 +3,9 @@ from typing import Optional
 import discord
 from discord.ext import commands
 
+from converters import CachedUser
+from replies import send_pages
+
 
 class Administration(commands.Cog):
     """Provides administrative commands."""
@@ -48,9 +51,7 @@ class Administration(commands.Cog):
             else:
                 successes += 1
                 pag.add_line(str(member))
-        await ctx.send(f'Successfully kicked {successes}/{len(members)} members:')
-        for page in pag.pages:
-            await ctx.send(page)
+        await send_pages(ctx, f'Successfully kicked {successes}/{len(members)} members:', pag)
 
     @commands.command()
     @commands.guild_only()
@@ -77,15 +78,13 @@ class Administration(commands.Cog):
             else:
                 successes += 1
                 pag.add_line(str(member))
-        await ctx.send(f'Successfully banned {successes}/{len(members)} members:')
-        for page in pag.pages:
-            await ctx.send(page)
+        await send_pages(ctx, f'Successfully banned {successes}/{len(members)} members:', pag)
 
     @commands.command()
     @commands.guild_only()
     @commands.has_permissions(ban_members=True)
     @commands.bot_has_permissions(ban_members=True)
-    async def unban(self, ctx: commands.Context, users: commands.Greedy[discord.User], reason: Optional[str]):
+    async def unban(self, ctx: commands.Context, users: commands.Greedy[CachedUser], reason: Optional[str]):
         """
         Unbans users.
 
@@ -103,9 +102,7 @@ class Administration(commands.Cog):
             else:
                 successes += 1
                 pag.add_line(str(user))
-        await ctx.send(f'Successfully unbanned {successes}/{len(users)} members:')
-        for page in pag.pages:
-            await ctx.send(page)
+        await send_pages(ctx, f'Successfully unbanned {successes}/{len(users)} members:', pag)
 
 
 def setup(bot: commands.Bot):
@@ -4,6 +4,9 @@ from typing import NoReturn, Optional, Dict, AnyStr, Any
 import discord
 from discord.ext import commands
 
+from converters import CachedUser
+from replies import send_pages
+
 
 class Economy(commands.Cog):
     """Provides the credits service, allowing users to manage useless virtual balances across guilds. Fun!"""
@@ -107,7 +110,7 @@ class Economy(commands.Cog):
             await ctx.send_help(self.credits)
 
     @credits.command(name='set')
-    async def creds_set(self, ctx: commands.Context, users: commands.Greedy[discord.User], amount: int):
+    async def creds_set(self, ctx: commands.Context, users: commands.Greedy[CachedUser], amount: int):
         """
         Sets users' credit amount.
 
@@ -120,12 +123,11 @@ class Economy(commands.Cog):
             old = self.credits_get(user, False)
             self.credits_set(user, amount)
             pag.add_line(f'{user} ({old} -> {amount})')
-        await ctx.send(f'Successfully set the account balance of the following users to {amount}:')
-        for page in pag.pages:
-            await ctx.send(page)
+        await send_pages(ctx, f'Successfully set the account balance of the following users to {amount}:',
+                         pag)
 
     @credits.command(name='add')
-    async def creds_add(self, ctx: commands.Context, users: commands.Greedy[discord.User], amount: int):
+    async def creds_add(self, ctx: commands.Context, users: commands.Greedy[CachedUser], amount: int):
         """
         Adds credits to a users' accounts.
 
@@ -141,9 +143,8 @@ class Economy(commands.Cog):
                 new = 0
             self.credits_set(user, new)
             pag.add_line(f'{user} ({old} -> {new})')
-        await ctx.send(f'Successfully added {amount} to the account balance of the following users:')
-        for page in pag.pages:
-            await ctx.send(page)
+        await send_pages(ctx, f'Successfully added {amount} to the account balance of the following users:',
+                         pag)
 
     @commands.command(name='account-create')
     async def acc_create(self, ctx: commands.Context):
@@ -154,7 +155,7 @@ class Economy(commands.Cog):
         self.credits_set(ctx.author, 0)
 
     @commands.command()
-    async def balance(self, ctx: commands.Context, user: Optional[discord.User]):
+    async def balance(self, ctx: commands.Context, user: Optional[CachedUser]):
         """
         Checks yours or another user's account balance.
 
@@ -206,7 +207,7 @@ class Economy(commands.Cog):
         await ctx.send(embed=embed)
 
     @commands.command()
-    async def transfer(self, ctx: commands.Context, target: discord.User, amount: int):
+    async def transfer(self, ctx: commands.Context, target: CachedUser, amount: int):
         """
         Transfers credits from your account to another user's account.
 
@@ -1,15 +1,31 @@
 import asyncio
 import json
+import os
 import sys
+import time
 import traceback
+import tracemalloc
+from collections import deque
+from datetime import datetime
 from os import path
-from typing import Dict, AnyStr, Any, NoReturn
+from typing import Dict, AnyStr, Any, NoReturn, Optional, List, Tuple
 
 import discord
 from discord.ext import commands, tasks
 
+import memstats
+import settings
+from fileutils import JsonFileWriter, StagedWrite
+from guildsettings import SettingsSchema, coerce_bool, coerce_str_list
+from profiler import SamplingProfiler
+from replies import send_pages
+from snapshots import SnapshotSource, write_snapshot
+
 ConfigDict = Dict[AnyStr, Any]
 
+# schema version of the state handed over to the cog of a reloaded extension. bump it when that state changes shape
+HANDOFF_VERSION = 7
+
 
 class System(commands.Cog):
     """Essential core cog. Provides the config service that stores settings per guild."""
@@ -17,7 +33,64 @@ class System(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self._configs = dict()
-        self.config_flush_auto.start()
+        self.settings_schema = SettingsSchema()
+        # guild key -> typed settings compiled from the guild's config
+        self._compiled = dict()
+        # settings of guilds without a config
+        self._defaults = None
+        # keys of guilds known to have no config file, so their settings are compiled without reading the disk again
+        self._no_config = set()
+        # keys of configs that may have changed since they were last flushed
+        self._dirty = set()
+        # writes flushed configs, possibly while the cache keeps changing
+        self._writer = JsonFileWriter()
+        # keys of configs that may have changed since the previous snapshot
+        self._snapshot_changed = set()
+        # while a snapshot is being written, keys of the only configs that may be flushed (the others are being read)
+        self._snapshot_pin = None
+        # file name of the previous snapshot, which incremental snapshots build on
+        self._last_snapshot = None
+        self._snapshot_count = 0
+        self._snapshot_lock = asyncio.Lock()
+        self._profiler = None
+        # tracemalloc snapshots taken with "sys memory snapshot", oldest first
+        self._mem_snapshots = deque(maxlen=10)
+        self._trace_stop = None
+        self._next_flush = None
+        handoff = getattr(bot, 'handoff', None)
+        state = None if handoff is None else handoff.adopt('System', HANDOFF_VERSION)
+        if state is not None:
+            # reloaded: keep the cache warm
+            self._configs = state['configs']
+            self.settings_schema = state['settings_schema']
+            self._compiled = state['compiled']
+            self._no_config = state['no_config']
+            self._dirty = state['dirty']
+            self._writer = state['writer']
+            self._snapshot_changed = state['snapshot_changed']
+            self._snapshot_pin = state['snapshot_pin']
+            self._last_snapshot = state['last_snapshot']
+            self._snapshot_count = state['snapshot_count']
+            # shared with a snapshot the previous instance may still be writing
+            self._snapshot_lock = state['snapshot_lock']
+            self._mem_snapshots = state['mem_snapshots']
+            self._trace_stop = state['trace_stop']
+            self._next_flush = state['next_flush']
+        if state is None or state['flush_auto']:
+            self.config_flush_auto.start()
+        self.settings_schema.register('prefixes', coerce_str_list, None,
+                                      'command prefixes (replacing the default ones), separated by spaces', 'System')
+        self.settings_schema.register('mention_prefix', coerce_bool, settings.mention_prefix,
+                                      'whether mentioning the bot works as a command prefix', 'System')
+        if settings.snapshot_interval is not None:
+            self.snapshot_auto.change_interval(hours=settings.snapshot_interval)
+            self.snapshot_auto.start()
+        metrics = getattr(bot, 'metrics', None)
+        if metrics is not None:
+            metrics.register_gauge('leobot_config_cached_guilds', lambda: len(self._configs))
+        shutdown = getattr(bot, 'shutdown', None)
+        if shutdown is not None:
+            shutdown.register_storage('configs', self.config_flush_dirty_async, self._stop_writers)
 
     def config_load(self, guild: discord.Guild) -> ConfigDict:
         """
@@ -27,36 +100,365 @@ class System(commands.Cog):
         :return: config for the specified guild.
         """
         guild_key = str(guild.id)
+        # callers may modify the returned config, so assume it changes
+        self._dirty.add(guild_key)
+        self._snapshot_changed.add(guild_key)
+        self._compiled.pop(guild_key, None)
         if guild_key in self._configs:
             return dict(self._configs[guild_key])
-        config_file = f'configs/{guild_key}.json'
-        if path.exists(config_file):
-            # read from file (and cache it)
-            f = open(config_file, 'r')
-            config_dict = self._configs[guild_key] = json.load(f)
-            f.close()
-        else:
+        return self._config_read(guild_key)
+
+    def _config_read(self, guild_key: str) -> ConfigDict:
+        config_dict = self._config_file(guild_key)
+        if config_dict is None:
             # create new store in cache
-            config_dict = self._configs[guild_key] = dict()
+            config_dict = dict()
+        # cache it
+        self._configs[guild_key] = config_dict
+        self._no_config.discard(guild_key)
+        return config_dict
+
+    @staticmethod
+    def _config_file(guild_key: str) -> Optional[ConfigDict]:
+        config_file = f'configs/{guild_key}.json'
+        if not path.exists(config_file):
+            return None
+        f = open(config_file, 'r')
+        config_dict = json.load(f)
+        f.close()
         return config_dict
 
+    def _default_settings(self) -> Any:
+        # shared by every guild without a config, recompiled when the schema changes
+        if self._defaults is None or self._defaults.__class__ is not self.settings_schema.cls:
+            self._defaults = self.settings_schema.compile(dict())
+        return self._defaults
+
+    def config_set(self, guild: discord.Guild, key: str, value: Any):
+        """
+        Sets a value in the configuration of a guild.
+
+        :param guild: guild to set the value for
+        :param key: key to set
+        :param value: new value. if None, removes the key
+        """
+        # config_load marks the config as changed, but returns a copy if it's cached
+        self.config_load(guild)
+        guild_key = str(guild.id)
+        config = self._configs[guild_key]
+        if value is None:
+            config.pop(key, None)
+        else:
+            config[key] = value
+        self._compiled.pop(guild_key, None)
+
+    def guild_settings(self, guild: discord.Guild) -> Any:
+        """
+        Gets the typed settings of a guild (see :attr:`settings_schema`), compiled from its configuration.
+
+        The settings are compiled once and cached until the configuration is loaded for modification again (or
+        settings are registered), so reading them is cheap. They must not be modified. A guild's configuration file is
+        only read the first time, and guilds without one share the default settings.
+
+        :param guild: guild to get the settings of
+        :return: object with an attribute for each registered setting
+        """
+        guild_key = str(guild.id)
+        compiled = self._compiled.get(guild_key)
+        if compiled is not None and compiled.__class__ is self.settings_schema.cls:
+            return compiled
+        config = self._configs.get(guild_key)
+        if config is None and guild_key not in self._no_config:
+            # read once, and cached without marking it as changed: reading settings doesn't modify it
+            config = self._config_file(guild_key)
+            if config is None:
+                self._no_config.add(guild_key)
+            else:
+                self._configs[guild_key] = config
+        if config is None:
+            compiled = self._compiled[guild_key] = self._default_settings()
+        else:
+            compiled = self._compiled[guild_key] = self.settings_schema.compile(config)
+        return compiled
+
     def config_flush(self) -> NoReturn:
         """Flushes the configuration cache to disk."""
-        for guild, config in self._configs.items():
-            f = open(f'configs/{guild}.json', 'w')
-            json.dump(config, f)
-            f.close()
+        self._dirty.update(self._configs.keys())
+        self.config_flush_dirty()
+
+    def _flush_stage(self, deadline: Optional[float]) -> List[StagedWrite]:
+        dirty = set(self._dirty)
+        # cleared in place, since the set is handed over across reloads while flushes may still be writing
+        self._dirty.clear()
+        staged = []
+        for guild in sorted(dirty):
+            config = self._configs.get(guild)
+            if config is None:
+                # dropped from the cache since it was loaded
+                continue
+            if self._snapshot_pin is not None and deadline is None and guild not in self._snapshot_pin:
+                # being read by a snapshot, so written once the snapshot is done (unless shutting down)
+                self._dirty.add(guild)
+                continue
+            staged.append(self._writer.stage(guild, f'configs/{guild}.json', config))
+        return staged
+
+    def _flush_finish(self, not_persisted: List[str], start: float):
+        self._dirty.update(not_persisted)
+        metrics = getattr(self.bot, 'metrics', None)
+        if metrics is not None:
+            metrics.observe('leobot_config_flush_seconds', time.perf_counter() - start)
+
+    def config_flush_dirty(self, deadline: Optional[float] = None) -> Tuple[List[str], List[str]]:
+        """
+        Flushes only the configurations that may have changed since they were last flushed. Blocks until they're
+        written, so the periodic flush uses :meth:`config_flush_dirty_async` instead.
+
+        :param deadline: :func:`time.monotonic` value after which no more configs are written. if None, writes every
+        dirty config
+        :return: keys of the configs that were persisted, and keys of the configs that weren't
+        """
+        start = time.perf_counter()
+        persisted, not_persisted = self._writer.write(self._flush_stage(deadline), deadline)
+        self._flush_finish(not_persisted, start)
+        return persisted, not_persisted
+
+    async def config_flush_dirty_async(self, deadline: Optional[float] = None) -> Tuple[List[str], List[str]]:
+        """
+        Like :meth:`config_flush_dirty`, but the configs are written by worker threads, without blocking the event
+        loop.
+        """
+        start = time.perf_counter()
+        staged = self._flush_stage(deadline)
+        writing = asyncio.ensure_future(self._writer.write_async(staged, deadline))
+
+        def finish(future: asyncio.Future):
+            if future.cancelled() or future.exception() is not None:
+                self._flush_finish([item.key for item in staged], start)
+            else:
+                self._flush_finish(future.result()[1], start)
+
+        # configs that weren't written are marked dirty again even if the caller (like the flush loop) is cancelled
+        writing.add_done_callback(finish)
+        return await asyncio.shield(writing)
+
+    def config_snapshot_capture(self, incremental: bool) -> SnapshotSource:
+        """
+        Captures the current state of the configurations for a snapshot. Must be followed by
+        :meth:`config_snapshot_release` once the snapshot is written.
+
+        :param incremental: if True, only captures the configurations that changed since the previous snapshot
+        :return: captured state
+        """
+        changed = self._snapshot_changed
+        self._snapshot_changed = set()
+        pin = set()
+        cached = dict()
+        for guild in (changed & self._dirty if incremental else self._dirty):
+            config = self._configs.get(guild)
+            if config is not None:
+                # not flushed yet, so the disk is out of date
+                cached[f'{guild}.json'] = json.dumps(config).encode('utf-8')
+                pin.add(guild)
+        disk = [f'{guild}.json' for guild in changed if guild not in pin] if incremental else None
+        self._snapshot_pin = pin
+        return SnapshotSource('configs', 'configs', cached, disk, changed)
+
+    def config_snapshot_release(self, source: SnapshotSource, success: bool):
+        """
+        Lets configurations captured by :meth:`config_snapshot_capture` be flushed again.
+
+        :param source: captured state
+        :param success: True if the snapshot was written, False otherwise
+        """
+        self._snapshot_pin = None
+        if not success:
+            self._snapshot_changed.update(source.changed)
+
+    def _snapshot_release(self, captures: List[SnapshotSource], success: bool):
+        for source in captures:
+            # the cogs may have been reloaded in the meantime, and a failing release mustn't keep the others pinned
+            try:
+                if source.name == 'configs':
+                    system = self.bot.get_cog('System')
+                    if system is not None:
+                        system.config_snapshot_release(source, success)
+                elif source.name == 'userdata':
+                    userdata = self.bot.get_cog('UserData')
+                    if userdata is not None:
+                        userdata.userdata_snapshot_release(source, success)
+            except Exception as e:
+                print(f'Failed to release the "{source.name}" snapshot capture.', file=sys.stderr)
+                traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+
+    async def snapshot(self, incremental: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """
+        Takes a consistent snapshot of the configurations and data stores (both cached and on disk), without blocking
+        the event loop while it's written.
+
+        :param incremental: if True, only includes what changed since the previous snapshot. ignored (taking a full
+        snapshot) if no snapshot was taken since the bot started
+        :return: file name and manifest of the snapshot
+        """
+        async with self._snapshot_lock:
+            incremental = incremental and self._last_snapshot is not None
+            kind = 'incr' if incremental else 'full'
+            stem = f'{settings.snapshot_dir}/snapshot-{datetime.now().strftime("%Y%m%d-%H%M%S")}'
+            file_name = f'{stem}-{kind}.tar.gz'
+            suffix = 1
+            while path.exists(file_name):
+                # taken in the same second as the previous one, which mustn't be overwritten
+                suffix += 1
+                file_name = f'{stem}.{suffix}-{kind}.tar.gz'
+            os.makedirs(settings.snapshot_dir, exist_ok=True)
+            # captured without yielding to the event loop, so no command runs in between
+            captures = [self.config_snapshot_capture(incremental)]
+            userdata = self.bot.get_cog('UserData')
+            if userdata is not None:
+                captures.append(userdata.userdata_snapshot_capture(incremental))
+            start = time.perf_counter()
+            success = False
+            try:
+                manifest = await self.bot.loop.run_in_executor(None, write_snapshot, file_name, captures, incremental,
+                                                               self._last_snapshot if incremental else None)
+                success = True
+            finally:
+                self._snapshot_release(captures, success)
+            metrics = getattr(self.bot, 'metrics', None)
+            if metrics is not None:
+                metrics.observe('leobot_snapshot_seconds', time.perf_counter() - start, dict(kind=kind))
+            # recorded by the current instance, in case the cog was reloaded in the meantime
+            system = self.bot.get_cog('System') or self
+            system._last_snapshot = path.basename(file_name)
+            system._snapshot_count += 1
+            return file_name, manifest
+
+    @tasks.loop(hours=24.0)
+    async def snapshot_auto(self):
+        incremental = self._snapshot_count % settings.snapshot_full_every != 0
+        try:
+            await self.snapshot(incremental)
+        except OSError as e:
+            print('Failed to take scheduled snapshot.', file=sys.stderr)
+            traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
 
     @tasks.loop(minutes=5.0)
     async def config_flush_auto(self):
-        self.config_flush()
+        await self.config_flush_dirty_async()
 
-    def cog_unload(self):
+    @config_flush_auto.before_loop
+    async def config_flush_auto_resume(self):
+        # after a reload, keep the schedule of the previous loop instead of flushing right away
+        if self._next_flush is not None:
+            await discord.utils.sleep_until(self._next_flush)
+            self._next_flush = None
+
+    def _stop_writers(self):
         try:
             self.config_flush_auto.cancel()
         except RuntimeError:
             pass
-        self.config_flush()
+        self.snapshot_auto.cancel()
+
+    def cog_unload(self):
+        flush_auto = self.config_flush_auto.is_running()
+        next_flush = self.config_flush_auto.next_iteration if flush_auto else None
+        self._stop_writers()
+        if self._profiler is not None:
+            # the profile command of this instance reports what was sampled so far
+            self._profiler.stop()
+        # the incoming instance registers its own settings, which may differ
+        self.settings_schema.unregister_owner('System')
+        handoff = getattr(self.bot, 'handoff', None)
+        if handoff is not None and handoff.expecting(__name__):
+            handoff.park('System', HANDOFF_VERSION,
+                         dict(configs=self._configs, settings_schema=self.settings_schema, compiled=self._compiled,
+                              no_config=self._no_config, dirty=self._dirty, writer=self._writer,
+                              snapshot_changed=self._snapshot_changed,
+                              snapshot_pin=self._snapshot_pin, last_snapshot=self._last_snapshot,
+                              snapshot_count=self._snapshot_count, snapshot_lock=self._snapshot_lock,
+                              mem_snapshots=self._mem_snapshots, trace_stop=self._trace_stop, flush_auto=flush_auto,
+                              next_flush=next_flush),
+                         self.config_flush_dirty)
+        else:
+            self.config_flush_dirty()
+        metrics = getattr(self.bot, 'metrics', None)
+        if metrics is not None:
+            metrics.unregister_gauge('leobot_config_cached_guilds')
+        shutdown = getattr(self.bot, 'shutdown', None)
+        if shutdown is not None:
+            shutdown.unregister_storage('configs')
+
+    def _broadcast(self, op: str, payload: Any = None):
+        cluster = getattr(self.bot, 'cluster', None)
+        if cluster is not None:
+            cluster.broadcast(op, payload)
+
+    def unload_all_extensions(self):
+        """Unloads all extensions, in reverse load order."""
+        exts = list(self.bot.extensions.keys())
+        for ext in reversed(exts):
+            self.bot.unload_extension(ext)
+
+    def load_or_reload_extension(self, ext: str) -> bool:
+        """
+        Loads an extension, or reloads it if it's already loaded.
+
+        :param ext: extension to load
+        :return: True if the extension was reloaded, False if it was newly loaded
+        :raises commands.ExtensionError: if the extension fails to load
+        """
+        try:
+            self.bot.load_extension(ext)
+        except commands.ExtensionAlreadyLoaded:
+            handoff = getattr(self.bot, 'handoff', None)
+            if handoff is None:
+                self.bot.reload_extension(ext)
+                return True
+            # lets the outgoing cog hand its state over to the incoming one
+            handoff.expect(ext)
+            try:
+                self.bot.reload_extension(ext)
+            finally:
+                handoff.finish(ext)
+            return True
+        return False
+
+    def unload_extension(self, ext: str):
+        """
+        Unloads an extension. The essential extension "cogs.system" can't be unloaded.
+
+        :param ext: extension to unload
+        :raises commands.ExtensionError: if the extension fails to unload
+        """
+        if ext == 'cogs.system':
+            raise commands.ExtensionError('Can\'t unload essential extension "cogs.system"', name='System')
+        self.bot.unload_extension(ext)
+
+    @commands.Cog.listener()
+    async def on_cluster_message(self, op: str, payload: Any):
+        if op == 'exit':
+            shutdown = getattr(self.bot, 'shutdown', None)
+            if shutdown is not None:
+                # this listener isn't a command, so nothing in flight needs to be skipped
+                await shutdown.begin('requested by another worker')
+                return
+            print('Shutting down (requested by another worker)...')
+            self.unload_all_extensions()
+            await self.bot.close()
+        elif op in ('exts_load', 'exts_unload'):
+            exts = tuple(payload)
+            if op == 'exts_load' and len(exts) == 0:
+                exts = tuple(self.bot.extensions)
+            for ext in exts:
+                try:
+                    if op == 'exts_load':
+                        self.load_or_reload_extension(ext)
+                    else:
+                        self.unload_extension(ext)
+                except commands.ExtensionError as e:
+                    print(f'Failed to {op[5:]} extension "{ext}" (requested by another worker).', file=sys.stderr)
+                    traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
 
     @commands.group(aliases=['sys'])
     @commands.is_owner()
@@ -86,13 +488,196 @@ class System(commands.Cog):
                 await ctx.send('Shutdown cancelled.')
                 return
 
+        self._broadcast('exit')
+        shutdown = getattr(self.bot, 'shutdown', None)
+        if shutdown is not None:
+            await ctx.send('**_Shutting down..._**')
+            await shutdown.begin(f'requested by {ctx.author}', from_command=True)
+            return
         await ctx.send("**_Unloading extensions..._**")
-        exts = list(self.bot.extensions.keys())
-        for ext in reversed(exts):
-            self.bot.unload_extension(ext)
+        self.unload_all_extensions()
         await ctx.send('**_Shutting down..._**')
         await self.bot.close()
 
+    @system.command(name='metrics')
+    async def sys_metrics(self, ctx: commands.Context):
+        """Shows the bot's metrics (command latencies, errors, event loop lag, flush timings and cache sizes)."""
+        metrics = getattr(self.bot, 'metrics', None)
+        if metrics is None:
+            await ctx.send('Metrics are not available.')
+            return
+        pag = commands.Paginator()
+        pag.clear()
+        for line in metrics.summary():
+            pag.add_line(line)
+        await send_pages(ctx, 'Current metrics:', pag)
+
+    @system.command(name='profile')
+    async def sys_profile(self, ctx: commands.Context, seconds: float = 10.0, all_threads: bool = False):
+        """
+        Profiles the running bot by sampling the stacks of the event loop's thread, without pausing command handling.
+
+        `[seconds]` - how long to profile for, between 1 and 300. default is 10
+        `[all_threads]` - if `True`, also samples the other threads (like executor workers)
+        """
+        if self._profiler is not None:
+            await ctx.send('A profile is already being taken.')
+            return
+        seconds = min(max(seconds, 1.0), 300.0)
+        self._profiler = profiler = SamplingProfiler(all_threads=all_threads)
+        try:
+            profiler.start()
+            await ctx.send(f'Profiling for {seconds:g} seconds...')
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+            self._profiler = None
+        file_name = f'profiles/profile-{datetime.now().strftime("%Y%m%d-%H%M%S")}.folded'
+        await self.bot.loop.run_in_executor(None, profiler.write_collapsed, file_name)
+        pag = commands.Paginator()
+        pag.clear()
+        pag.add_line(f'{"self":>6} {"total":>6}  function')
+        samples = max(profiler.samples, 1)
+        for label, self_samples, total_samples in profiler.top(15):
+            pag.add_line(f'{self_samples / samples:6.1%} {total_samples / samples:6.1%}  {label}')
+        await send_pages(ctx, f'Took {profiler.samples} stack samples. Collapsed stacks were written to `{file_name}`.\n'
+                              f'Hottest functions:', pag)
+
+    @system.command(name='snapshot')
+    async def sys_snapshot(self, ctx: commands.Context, incremental: bool = False):
+        """
+        Takes a consistent snapshot of the configurations and data stores, while the bot keeps running.
+
+        `[incremental]` - if `True`, only includes what changed since the previous snapshot
+        """
+        if self._snapshot_lock.locked():
+            await ctx.send('A snapshot is already being taken, waiting for it to finish...')
+        try:
+            file_name, manifest = await self.snapshot(incremental)
+        except OSError as e:
+            await ctx.send(f'Failed to take snapshot: {e}')
+            return
+        stores = ', '.join(f'{len(entries)} {name}' for name, entries in manifest['stores'].items())
+        base = f', based on `{manifest["base"]}`' if manifest['incremental'] else ''
+        await ctx.send(f'Took {"an incremental" if manifest["incremental"] else "a full"} snapshot ({stores}{base}). '
+                       f'It was written to `{file_name}`.')
+
+    def memory_caches(self) -> Dict[str, Any]:
+        """
+        :return: name -> cache, for the caches of the cogs, of the bot's services and of discord.py
+        """
+        bot = self.bot
+        caches = dict()
+        userdata = bot.get_cog('UserData')
+        if userdata is not None:
+            caches['UserData._userdata'] = userdata._userdata
+        caches['System._configs'] = self._configs
+        caches['System._compiled'] = self._compiled
+        caches['System._mem_snapshots'] = self._mem_snapshots
+        for service, name in (('user_resolver', '_cache'), ('replies', '_buckets'), ('error_governor', '_entries')):
+            cache = getattr(getattr(bot, service, None), name, None)
+            if cache is not None:
+                caches[f'{service}.{name}'] = cache
+        for name in ('_users', '_guilds', '_private_channels', '_emojis', '_messages'):
+            cache = getattr(bot._connection, name, None)
+            if cache is not None:
+                caches[f'discord.{name}'] = cache
+        return caches
+
+    async def memory_usage(self) -> List[memstats.CacheSize]:
+        """
+        Measures the caches listed by :meth:`memory_caches` in a worker thread.
+
+        :return: size of each cache
+        """
+        bot = self.bot
+        # referenced from almost every cached object, and measured separately
+        exclude = {id(bot), id(bot.loop), id(bot.http), id(bot._connection)}
+        exclude.update(id(cog) for cog in bot.cogs.values())
+        return await bot.loop.run_in_executor(None, memstats.cache_sizes, self.memory_caches(), exclude)
+
+    @system.group(name='memory', aliases=['mem'])
+    async def sys_memory(self, ctx: commands.Context):
+        """
+        Shows how much memory the caches use (estimated from a sample for large caches, marked with ~), and how many
+        paginators, embeds and messages are alive.
+        """
+        if ctx.invoked_subcommand is not None:
+            return
+        sizes = sorted(await self.memory_usage(), key=lambda size: size.size, reverse=True)
+        live = await self.bot.loop.run_in_executor(None, memstats.live_instances,
+                                                   (commands.Paginator, discord.Embed, discord.Message))
+        pag = commands.Paginator()
+        pag.clear()
+        for size in sizes:
+            pag.add_line(f'{"~" if size.estimated else " "}{size.size / 1024:10.1f} KiB {size.entries:8d}  {size.name}')
+        pag.add_line('')
+        pag.add_line('live: ' + ', '.join(f'{count} {name}' for name, count in live.items()))
+        rss = memstats.current_rss()
+        header = f'Resident set size: {"unknown" if rss is None else f"{rss / 1048576:.1f} MiB"}'
+        if tracemalloc.is_tracing():
+            traced, peak = tracemalloc.get_traced_memory()
+            header += f', traced: {traced / 1048576:.1f} MiB (peak {peak / 1048576:.1f} MiB)'
+        await send_pages(ctx, f'{header}\nCache sizes:', pag)
+
+    @sys_memory.command(name='trace')
+    async def mem_trace(self, ctx: commands.Context, state: bool, frames: int = 1, minutes: float = 10.0):
+        """
+        Starts or stops tracing allocations, which "sys memory snapshot" needs. Tracing slows the bot down (more so
+        with more frames), so it stops by itself after a while.
+
+        `<state>` - `True` to start tracing, `False` to stop
+        `[frames]` - frames of the stack to record per allocation, between 1 and 25. default is 1
+        `[minutes]` - time after which tracing stops by itself. default is 10
+        """
+        if self._trace_stop is not None:
+            self._trace_stop.cancel()
+            self._trace_stop = None
+        if not state:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            await ctx.send('Stopped tracing allocations.')
+            return
+        if tracemalloc.is_tracing():
+            await ctx.send('Allocations are already being traced.')
+            return
+        tracemalloc.start(min(max(frames, 1), 25))
+        self._trace_stop = self.bot.loop.call_later(minutes * 60, tracemalloc.stop)
+        await ctx.send(f'Tracing allocations for {minutes:g} minutes.')
+
+    @sys_memory.command(name='snapshot')
+    async def mem_snapshot(self, ctx: commands.Context):
+        """Takes a snapshot of the traced allocations, to compare with "sys memory diff"."""
+        if not tracemalloc.is_tracing():
+            await ctx.send('Allocations aren\'t being traced, start tracing with "sys memory trace True" first.')
+            return
+        snapshot = await self.bot.loop.run_in_executor(None, memstats.take_snapshot)
+        self._mem_snapshots.append(snapshot)
+        traced = sum(stat.size for stat in snapshot.statistics('filename'))
+        await ctx.send(f'Took snapshot {len(self._mem_snapshots) - 1} ({traced / 1048576:.1f} MiB traced). '
+                       f'{len(self._mem_snapshots)} snapshots are kept.')
+
+    @sys_memory.command(name='diff')
+    async def mem_diff(self, ctx: commands.Context, old: int = -2, new: int = -1):
+        """
+        Compares two snapshots by allocation site, showing where memory grew the most.
+
+        `[old]` - index of the earlier snapshot. default is the second to last one
+        `[new]` - index of the later snapshot. default is the last one
+        """
+        try:
+            old_snapshot = self._mem_snapshots[old]
+            new_snapshot = self._mem_snapshots[new]
+        except IndexError:
+            await ctx.send(f'No such snapshot ({len(self._mem_snapshots)} snapshots are kept).')
+            return
+        lines = await self.bot.loop.run_in_executor(None, memstats.top_growth, old_snapshot, new_snapshot)
+        pag = commands.Paginator()
+        pag.clear()
+        for line in lines:
+            pag.add_line(line)
+        await send_pages(ctx, 'Top allocation growth:', pag)
+
     @system.group(aliases=['cfgs', 'configs'])
     async def configurations(self, ctx: commands.Context):
         """Commands that manage the bot's configuration cache."""
@@ -148,6 +733,8 @@ class System(commands.Cog):
             except RuntimeError:
                 pass
         self._configs = dict()
+        self._compiled = dict()
+        self._no_config = set()
 
     @configurations.command(name='reload-all')
     async def cfgs_reload_all(self, ctx: commands.Context):
@@ -163,6 +750,44 @@ class System(commands.Cog):
                 cfgs_to_del.append(guild)
         for guild in cfgs_to_del:
             del self._configs[guild]
+        self._compiled = dict()
+        self._no_config = set()
+
+    @configurations.command(name='settings')
+    async def cfgs_settings(self, ctx: commands.Context, guild_id: int):
+        """
+        Shows the settings of a guild.
+
+        `<guild_id>` - ID of the guild
+        """
+        compiled = self.guild_settings(discord.Object(guild_id))
+        pag = commands.Paginator()
+        pag.clear()
+        for setting in self.settings_schema.settings():
+            pag.add_line(f'{setting.name} = {getattr(compiled, setting.name)!r} ({setting.description}, '
+                         f'default: {setting.default!r})')
+        await send_pages(ctx, f'Settings of guild {guild_id}:', pag)
+
+    @configurations.command(name='set')
+    async def cfgs_set(self, ctx: commands.Context, guild_id: int, name: str, *, value: Optional[str] = None):
+        """
+        Changes a setting of a guild.
+
+        `<guild_id>` - ID of the guild
+        `<name>` - name of the setting
+        `[value]` - new value. if not specified, resets the setting to its default
+        """
+        setting = self.settings_schema.get(name)
+        if setting is None:
+            raise commands.BadArgument(f'Setting "{name}" does not exist.')
+        if value is not None:
+            try:
+                value = setting.coerce(value)
+            except (ValueError, TypeError) as e:
+                raise commands.BadArgument(f'Invalid value for setting "{name}": {e}')
+        self.config_set(discord.Object(guild_id), name, value)
+        await ctx.send(f'Setting "{name}" of guild {guild_id} is now '
+                       f'{getattr(self.guild_settings(discord.Object(guild_id)), name)!r}.')
 
     @system.group(aliases=['exts'])
     async def extensions(self, ctx: commands.Context):
@@ -178,9 +803,7 @@ class System(commands.Cog):
         pag.clear()
         for ext in exts:
             pag.add_line(ext)
-        await ctx.send(f'{len(exts)} extensions currently loaded:\n')
-        for page in pag.pages:
-            await ctx.send(page)
+        await send_pages(ctx, f'{len(exts)} extensions currently loaded:\n', pag)
 
     @extensions.command(name='load', aliases=['reload'])
     async def exts_load(self, ctx: commands.Context, *exts: str):
@@ -198,28 +821,21 @@ class System(commands.Cog):
         pag.clear()
         for ext in exts:
             try:
-                self.bot.load_extension(ext)
-            except commands.ExtensionAlreadyLoaded as e:
-                try:
-                    self.bot.reload_extension(ext)
-                except commands.ExtensionError as e:
-                    await ctx.send(f'Failed to reload extension "{ext}": {str(e)}')
-                    print(f'Failed to reload extension "{ext}".', file=sys.stderr)
-                    traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
-                else:
-                    reloaded += 1
-                    pag.add_line(f'{ext} (reloaded)')
+                was_reloaded = self.load_or_reload_extension(ext)
             except commands.ExtensionError as e:
-                await ctx.send(f'Failed to load extension "{ext}": {str(e)}')
+                pag.add_line(f'{ext} (failed: {str(e)})')
                 print(f'Failed to load extension "{ext}".', file=sys.stderr)
                 traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
             else:
-                loaded += 1
-                pag.add_line(f'{ext} (newly loaded)')
-        await ctx.send(f'{loaded + reloaded}/{len(exts)} extensions successfully loaded '
-                       f'({loaded} newly loaded, {reloaded} reloaded):')
-        for page in pag.pages:
-            await ctx.send(page)
+                if was_reloaded:
+                    reloaded += 1
+                    pag.add_line(f'{ext} (reloaded)')
+                else:
+                    loaded += 1
+                    pag.add_line(f'{ext} (newly loaded)')
+        self._broadcast('exts_load', list(exts))
+        await send_pages(ctx, f'{loaded + reloaded}/{len(exts)} extensions successfully loaded '
+                              f'({loaded} newly loaded, {reloaded} reloaded):', pag)
 
     @extensions.command(name='unload')
     async def exts_unload(self, ctx: commands.Context, *exts: str):
@@ -233,19 +849,16 @@ class System(commands.Cog):
         pag.clear()
         for ext in exts:
             try:
-                if ext == 'cogs.system':
-                    raise commands.ExtensionError('Can\'t unload essential extension "cogs.system"', name='System')
-                self.bot.unload_extension(ext)
+                self.unload_extension(ext)
             except commands.ExtensionError as e:
-                await ctx.send(f'Failed to unload extension "{ext}": {str(e)}')
+                pag.add_line(f'{ext} (failed: {str(e)})')
                 print(f'Failed to unload extension "{ext}".', file=sys.stderr)
                 traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
             else:
                 unloaded += 1
                 pag.add_line(f'{ext}')
-        await ctx.send(f'{unloaded}/{len(exts)} extensions successfully unloaded:')
-        for page in pag.pages:
-            await ctx.send(page)
+        self._broadcast('exts_unload', list(exts))
+        await send_pages(ctx, f'{unloaded}/{len(exts)} extensions successfully unloaded:', pag)
 
 
 def setup(bot: commands.Bot):
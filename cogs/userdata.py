@@ -1,13 +1,29 @@
+import asyncio
+import gzip
 import json
 import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from os import path
-from typing import Optional, Dict, Any, AnyStr, NoReturn
+from typing import Optional, Dict, Any, AnyStr, NoReturn, List, Tuple
 
 import discord
 from discord.ext import commands, tasks
 
+import settings
+from fileutils import JsonFileWriter, StagedWrite, write_json_atomic
+from snapshots import SnapshotSource
+
 UserDict = Dict[AnyStr, Any]
 
+# directory dormant data stores are archived to, gzipped
+COLD_DIR = 'userdata/.cold'
+
+# schema version of the state handed over to the cog of a reloaded extension. bump it when that state changes shape
+HANDOFF_VERSION = 5
+
 
 class UserData(commands.Cog):
     """Provides the userdata service, allowing the bot to store information about specific users, with each user
@@ -16,7 +32,49 @@ class UserData(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self._userdata = dict()
-        self.userdata_flush_auto.start()
+        # (guild, user) keys of stores that may have changed since they were last flushed
+        self._dirty = set()
+        # (guild, user) keys of stores that may have changed (or been removed) since the previous snapshot, and
+        # (COLD_DIR, guild, user) keys of stores moved to or from the cold tier since then
+        self._snapshot_changed = set()
+        # while a snapshot is being written, keys of the only stores that may be flushed (the others are being read)
+        self._snapshot_pin = None
+        # held while moving stores between disk and the cold tier, or deciding to
+        self._disk_lock = threading.Lock()
+        # cold tier files of stores moved back out while a snapshot was being written, removed once it's done
+        self._cold_leftovers = []
+        # writes flushed stores, possibly while the cache keeps changing
+        self._writer = JsonFileWriter()
+        # held for a whole compaction pass, so passes (of this instance or a reloaded one) never overlap
+        self._compact_lock = threading.Lock()
+        self._next_flush = None
+        self._next_compact = None
+        handoff = getattr(bot, 'handoff', None)
+        state = None if handoff is None else handoff.adopt('UserData', HANDOFF_VERSION)
+        if state is not None:
+            # reloaded: keep the cache warm
+            self._userdata = state['userdata']
+            self._dirty = state['dirty']
+            self._snapshot_changed = state['snapshot_changed']
+            self._snapshot_pin = state['snapshot_pin']
+            self._disk_lock = state['disk_lock']
+            self._cold_leftovers = state['cold_leftovers']
+            self._writer = state['writer']
+            self._compact_lock = state['compact_lock']
+            self._next_flush = state['next_flush']
+            self._next_compact = state['next_compact']
+        if state is None or state['flush_auto']:
+            self.userdata_flush_auto.start()
+        if settings.userdata_compact_interval is not None:
+            self.userdata_compact_auto.change_interval(hours=settings.userdata_compact_interval)
+            self.userdata_compact_auto.start()
+        metrics = getattr(bot, 'metrics', None)
+        if metrics is not None:
+            metrics.register_gauge('leobot_userdata_cached_stores',
+                                   lambda: sum(len(guild_dict) for guild_dict in self._userdata.values()))
+        shutdown = getattr(bot, 'shutdown', None)
+        if shutdown is not None:
+            shutdown.register_storage('userdata', self.userdata_flush_dirty_async, self._stop_writers)
 
     def userdata_load(self, guild: Optional[discord.Guild], user: discord.User) -> UserDict:
         """
@@ -26,48 +84,301 @@ class UserData(commands.Cog):
         :param user: user to load data for
         :return: data for the specified user, in the scope of the specified guild.
         """
+        cluster = getattr(self.bot, 'cluster', None)
+        if guild is None and cluster is not None:
+            # global data is shared between all workers of the cluster
+            return cluster.store.load('_GLOBAL', str(user.id))
         guild_key = '_GLOBAL' if guild is None else str(guild.id)
         if guild_key in self._userdata:
             guild_dict = self._userdata[guild_key]
         else:
             guild_dict = self._userdata[guild_key] = dict()
         user_key = str(user.id)
+        # callers may modify the returned data, so assume it changes
+        self._dirty.add((guild_key, user_key))
+        self._snapshot_changed.add((guild_key, user_key))
         # try to locate in cache first
         if user_key in guild_dict:
             return dict(guild_dict[user_key])
-        user_file = f'userdata/{guild_key}/{str(user.id)}.json'
-        if path.exists(user_file):
-            # read from file (and cache it)
-            f = open(user_file, 'r')
-            user_dict = guild_dict[user_key] = json.load(f)
-            f.close()
-        else:
-            # create new store in cache
-            user_dict = guild_dict[user_key] = dict()
+        user_file = f'userdata/{guild_key}/{user_key}.json'
+        cold_file = f'{COLD_DIR}/{guild_key}/{user_key}.json.gz'
+        with self._disk_lock:
+            if path.exists(user_file):
+                # read from file (and cache it)
+                f = open(user_file, 'r')
+                user_dict = guild_dict[user_key] = json.load(f)
+                f.close()
+            elif path.exists(cold_file):
+                # read from the cold tier (and move it back out, so it isn't lost if the cache is cleared)
+                f = gzip.open(cold_file, 'rt')
+                user_dict = guild_dict[user_key] = json.load(f)
+                f.close()
+                os.makedirs(f'userdata/{guild_key}', exist_ok=True)
+                write_json_atomic(user_file, user_dict)
+                if self._snapshot_pin is None:
+                    os.remove(cold_file)
+                else:
+                    # a snapshot may be about to read it
+                    self._cold_leftovers.append(cold_file)
+                self._snapshot_changed.add((COLD_DIR, guild_key, user_key))
+                metrics = getattr(self.bot, 'metrics', None)
+                if metrics is not None:
+                    metrics.inc('leobot_userdata_rehydrated_total')
+            else:
+                # create new store in cache
+                user_dict = guild_dict[user_key] = dict()
         return user_dict
 
     def userdata_flush(self) -> NoReturn:
         """Flushes the data store cache to disk."""
-        for guild in self._userdata.keys():
-            guild_dict = self._userdata[guild]
-            for user in guild_dict.keys():
-                user_file_dir = f'userdata/{guild}'
-                os.makedirs(user_file_dir, exist_ok=True)
-                user_file = f'{user_file_dir}/{user}.json'
-                f = open(user_file, 'w')
-                json.dump(guild_dict[user], f)
-                f.close()
+        for guild, guild_dict in self._userdata.items():
+            self._dirty.update((guild, user) for user in guild_dict)
+        self.userdata_flush_dirty()
+
+    def _flush_stage(self, deadline: Optional[float]) -> List[StagedWrite]:
+        dirty = set(self._dirty)
+        # cleared in place, since the set is handed over across reloads while flushes may still be writing
+        self._dirty.clear()
+        staged = []
+        for guild, user in sorted(dirty):
+            guild_dict = self._userdata.get(guild)
+            if guild_dict is None or user not in guild_dict:
+                # dropped from the cache since it was loaded
+                continue
+            if self._snapshot_pin is not None and deadline is None and (guild, user) not in self._snapshot_pin:
+                # being read by a snapshot, so written once the snapshot is done (unless shutting down)
+                self._dirty.add((guild, user))
+                continue
+            # users who were merely looked up don't need a file
+            data = guild_dict[user] if len(guild_dict[user]) > 0 else None
+            staged.append(self._writer.stage((guild, user), f'userdata/{guild}/{user}.json', data))
+        return staged
+
+    def _flush_finish(self, not_persisted: List[Tuple[str, str]], start: float):
+        self._dirty.update(not_persisted)
+        metrics = getattr(self.bot, 'metrics', None)
+        if metrics is not None:
+            metrics.observe('leobot_userdata_flush_seconds', time.perf_counter() - start)
+
+    def userdata_flush_dirty(self, deadline: Optional[float] = None) -> Tuple[List[str], List[str]]:
+        """
+        Flushes only the data stores that may have changed since they were last flushed. Blocks until they're written,
+        so the periodic flush uses :meth:`userdata_flush_dirty_async` instead.
+
+        :param deadline: :func:`time.monotonic` value after which no more stores are written. if None, writes every
+        dirty store
+        :return: keys of the stores that were persisted, and keys of the stores that weren't
+        """
+        start = time.perf_counter()
+        persisted, not_persisted = self._writer.write(self._flush_stage(deadline), deadline)
+        self._flush_finish(not_persisted, start)
+        return [f'{guild}/{user}' for guild, user in persisted], [f'{guild}/{user}' for guild, user in not_persisted]
+
+    async def userdata_flush_dirty_async(self, deadline: Optional[float] = None) -> Tuple[List[str], List[str]]:
+        """
+        Like :meth:`userdata_flush_dirty`, but the stores are written by worker threads, without blocking the event
+        loop.
+        """
+        start = time.perf_counter()
+        staged = self._flush_stage(deadline)
+        writing = asyncio.ensure_future(self._writer.write_async(staged, deadline))
+
+        def finish(future: asyncio.Future):
+            if future.cancelled() or future.exception() is not None:
+                self._flush_finish([item.key for item in staged], start)
+            else:
+                self._flush_finish(future.result()[1], start)
+
+        # stores that weren't written are marked dirty again even if the caller (like the flush loop) is cancelled
+        writing.add_done_callback(finish)
+        persisted, not_persisted = await asyncio.shield(writing)
+        return [f'{guild}/{user}' for guild, user in persisted], [f'{guild}/{user}' for guild, user in not_persisted]
+
+    def userdata_compact(self) -> Tuple[int, int]:
+        """
+        Compacts the data stores on disk: removes empty stores, and moves stores untouched for
+        ``settings.userdata_cold_after`` days to the cold tier (they're moved back out when they're next loaded).
+        Cached stores are left alone.
+
+        Blocks, so it should be run in a worker thread.
+
+        :return: amount of stores removed, and amount of stores moved to the cold tier
+        """
+        pruned, archived = self._compact_stores()
+        return len(pruned), len(archived)
+
+    def _compact_stores(self) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        with self._compact_lock:
+            return self._compact()
+
+    def _compact(self) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        cold_before = None
+        if settings.userdata_cold_after is not None:
+            cold_before = time.time() - settings.userdata_cold_after * 86400
+        # global data of a cluster lives in its shared store, which may still import it from here
+        skip = {'.cold', '_GLOBAL'} if getattr(self.bot, 'cluster', None) is not None else {'.cold'}
+        pruned = []
+        archived = []
+        if not path.isdir('userdata'):
+            return pruned, archived
+        for guild_entry in os.scandir('userdata'):
+            if not guild_entry.is_dir() or guild_entry.name in skip:
+                continue
+            guild = guild_entry.name
+            for entry in os.scandir(guild_entry.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                user = entry.name[:-len('.json')]
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                # an empty store is written as "{}"
+                empty = stat.st_size <= 2
+                if not empty and (cold_before is None or stat.st_mtime >= cold_before):
+                    continue
+                with self._disk_lock:
+                    guild_dict = self._userdata.get(guild)
+                    if self._snapshot_pin is not None or (guild_dict is not None and user in guild_dict):
+                        continue
+                    try:
+                        f = open(entry.path, 'rb')
+                        data = f.read()
+                        f.close()
+                        if empty and json.loads(data) == dict():
+                            os.remove(entry.path)
+                            pruned.append((guild, user))
+                            continue
+                        if cold_before is None or stat.st_mtime >= cold_before:
+                            continue
+                        cold_file = f'{COLD_DIR}/{guild}/{user}.json.gz'
+                        os.makedirs(f'{COLD_DIR}/{guild}', exist_ok=True)
+                        f = gzip.open(f'{cold_file}.tmp', 'wb')
+                        f.write(data)
+                        f.close()
+                        os.replace(f'{cold_file}.tmp', cold_file)
+                        os.remove(entry.path)
+                        archived.append((guild, user))
+                    except (OSError, ValueError) as e:
+                        print(f'Failed to compact data store "{guild}/{user}": {e!r}', file=sys.stderr)
+        return pruned, archived
+
+    async def userdata_compact_async(self) -> Tuple[int, int]:
+        """Runs :meth:`userdata_compact` in a worker thread."""
+        start = time.perf_counter()
+        pruned, archived = await self.bot.loop.run_in_executor(None, self._compact_stores)
+        # so the next incremental snapshot records the removed (and moved) stores
+        self._snapshot_changed.update(pruned)
+        self._snapshot_changed.update(archived)
+        self._snapshot_changed.update((COLD_DIR, guild, user) for guild, user in archived)
+        metrics = getattr(self.bot, 'metrics', None)
+        if metrics is not None:
+            metrics.observe('leobot_userdata_compact_seconds', time.perf_counter() - start)
+            metrics.inc('leobot_userdata_pruned_total', amount=len(pruned))
+            metrics.inc('leobot_userdata_archived_total', amount=len(archived))
+        return len(pruned), len(archived)
+
+    @tasks.loop(hours=6.0)
+    async def userdata_compact_auto(self):
+        await self.userdata_compact_async()
+
+    @userdata_compact_auto.before_loop
+    async def userdata_compact_auto_delay(self):
+        # compacting isn't urgent: wait an interval (or, after a reload, until the previous loop's next pass) first
+        if self._next_compact is None:
+            self._next_compact = datetime.now(timezone.utc) + timedelta(hours=self.userdata_compact_auto.hours)
+        await discord.utils.sleep_until(self._next_compact)
+        self._next_compact = None
+
+    def userdata_snapshot_capture(self, incremental: bool) -> SnapshotSource:
+        """
+        Captures the current state of the data stores for a snapshot. Must be followed by
+        :meth:`userdata_snapshot_release` once the snapshot is written.
+
+        :param incremental: if True, only captures the stores that changed since the previous snapshot
+        :return: captured state
+        """
+        changed = self._snapshot_changed
+        self._snapshot_changed = set()
+        pin = set()
+        cached = dict()
+        for guild, user in (changed & self._dirty if incremental else self._dirty):
+            guild_dict = self._userdata.get(guild)
+            if guild_dict is not None and user in guild_dict:
+                # not flushed yet, so the disk is out of date. empty stores are removed when flushed
+                user_dict = guild_dict[user]
+                cached[f'{guild}/{user}.json'] = json.dumps(user_dict).encode('utf-8') if len(user_dict) > 0 else None
+                pin.add((guild, user))
+        disk = None
+        if incremental:
+            # stores missing from the disk are recorded as removed
+            cold_root = path.relpath(COLD_DIR, 'userdata')
+            disk = [f'{key[0]}/{key[1]}.json' if len(key) == 2 else f'{cold_root}/{key[1]}/{key[2]}.json.gz'
+                    for key in changed if key not in pin]
+        with self._disk_lock:
+            # stops the stores from being moved to the cold tier
+            self._snapshot_pin = pin
+        return SnapshotSource('userdata', 'userdata', cached, disk, changed)
+
+    def userdata_snapshot_release(self, source: SnapshotSource, success: bool):
+        """
+        Lets stores captured by :meth:`userdata_snapshot_capture` be flushed again.
+
+        :param source: captured state
+        :param success: True if the snapshot was written, False otherwise
+        """
+        with self._disk_lock:
+            self._snapshot_pin = None
+            for cold_file in self._cold_leftovers:
+                try:
+                    os.remove(cold_file)
+                except FileNotFoundError:
+                    pass
+            self._cold_leftovers = []
+        if not success:
+            self._snapshot_changed.update(source.changed)
 
     @tasks.loop(minutes=5.0)
     async def userdata_flush_auto(self):
-        self.userdata_flush()
+        await self.userdata_flush_dirty_async()
 
-    def cog_unload(self):
+    @userdata_flush_auto.before_loop
+    async def userdata_flush_auto_resume(self):
+        # after a reload, keep the schedule of the previous loop instead of flushing right away
+        if self._next_flush is not None:
+            await discord.utils.sleep_until(self._next_flush)
+            self._next_flush = None
+
+    def _stop_writers(self):
         try:
             self.userdata_flush_auto.cancel()
         except RuntimeError:
             pass
-        self.userdata_flush()
+        self.userdata_compact_auto.cancel()
+
+    def cog_unload(self):
+        flush_auto = self.userdata_flush_auto.is_running()
+        next_flush = self.userdata_flush_auto.next_iteration if flush_auto else None
+        next_compact = self._next_compact
+        if next_compact is None and self.userdata_compact_auto.is_running():
+            next_compact = self.userdata_compact_auto.next_iteration
+        self._stop_writers()
+        handoff = getattr(self.bot, 'handoff', None)
+        if handoff is not None and handoff.expecting(__name__):
+            handoff.park('UserData', HANDOFF_VERSION,
+                         dict(userdata=self._userdata, dirty=self._dirty, snapshot_changed=self._snapshot_changed,
+                              snapshot_pin=self._snapshot_pin, disk_lock=self._disk_lock, writer=self._writer,
+                              cold_leftovers=self._cold_leftovers, compact_lock=self._compact_lock,
+                              flush_auto=flush_auto, next_flush=next_flush, next_compact=next_compact),
+                         self.userdata_flush_dirty)
+        else:
+            self.userdata_flush_dirty()
+        metrics = getattr(self.bot, 'metrics', None)
+        if metrics is not None:
+            metrics.unregister_gauge('leobot_userdata_cached_stores')
+        shutdown = getattr(self.bot, 'shutdown', None)
+        if shutdown is not None:
+            shutdown.unregister_storage('userdata')
 
     @commands.group(aliases=['ud'])
     @commands.is_owner()
@@ -112,6 +423,12 @@ class UserData(commands.Cog):
             except RuntimeError:
                 await ctx.send('Auto flush loop has already been cancelled.')
 
+    @userdata.command(name='compact')
+    async def ud_compact(self, ctx: commands.Context):
+        """Removes empty data stores from disk, and moves dormant ones to the cold tier."""
+        pruned, archived = await self.userdata_compact_async()
+        await ctx.send(f'Removed {pruned} empty data stores and moved {archived} dormant ones to the cold tier.')
+
     @userdata.command(name='clear-cache')
     async def ud_clrcache(self, ctx: commands.Context, flush: bool = True):
         """
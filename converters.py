@@ -0,0 +1,95 @@
+import asyncio
+import re
+from typing import Dict, Optional
+
+import discord
+from discord.ext import commands
+
+from ttlcache import TTLCache
+
+_MISSING = object()
+_ID_PATTERN = re.compile(r'<@!?([0-9]{15,21})>$|([0-9]{15,21})$')
+
+
+class UserResolver:
+    """Resolves user IDs to users, caching the results of API lookups for users that aren't in the gateway cache.
+
+    Unknown IDs are cached too (for a shorter time), and concurrent lookups of the same ID share a single request.
+    """
+
+    def __init__(self, bot: commands.Bot, ttl: float = 600.0, negative_ttl: float = 60.0, maxsize: int = 10000):
+        """
+        :param bot: bot to look users up with
+        :param ttl: time (in seconds) a found user is cached for
+        :param negative_ttl: time (in seconds) an unknown ID is cached for
+        :param maxsize: maximum amount of IDs cached at once
+        """
+        self.bot = bot
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+        self._pending: Dict[int, asyncio.Future] = dict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _count(self, result: str):
+        metrics = getattr(self.bot, 'metrics', None)
+        if metrics is not None:
+            metrics.inc('leobot_user_resolver_lookups_total', dict(result=result))
+
+    async def _fetch(self, user_id: int) -> Optional[discord.User]:
+        try:
+            user = await self.bot.fetch_user(user_id)
+        except discord.NotFound:
+            self._cache.set(user_id, None, self.negative_ttl)
+            return None
+        finally:
+            del self._pending[user_id]
+        self._cache.set(user_id, user)
+        return user
+
+    async def resolve(self, user_id: int) -> Optional[discord.User]:
+        """
+        Resolves a user ID.
+
+        :param user_id: ID of the user
+        :return: the user, or None if no user has that ID
+        :raises discord.HTTPException: if looking the user up fails
+        """
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            self._count('gateway')
+            return user
+        user = self._cache.get(user_id, _MISSING)
+        if user is not _MISSING:
+            self._count('cached')
+            return user
+        pending = self._pending.get(user_id)
+        if pending is None:
+            self._count('fetched')
+            pending = self._pending[user_id] = asyncio.ensure_future(self._fetch(user_id))
+        else:
+            self._count('coalesced')
+        # shielded, so one command being cancelled doesn't cancel the lookup for everyone else
+        return await asyncio.shield(pending)
+
+
+class CachedUser(commands.Converter):
+    """Converts to a :class:`.User`, like :class:`.UserConverter`, but resolves IDs and mentions through the bot's
+    :class:`UserResolver` instead of hitting the API every time.
+
+    Falls back to :class:`.UserConverter` for name lookups, or if the bot has no user resolver.
+    """
+
+    async def convert(self, ctx: commands.Context, argument: str) -> discord.User:
+        resolver: Optional[UserResolver] = getattr(ctx.bot, 'user_resolver', None)
+        match = _ID_PATTERN.match(argument)
+        if resolver is None or match is None:
+            return await commands.UserConverter().convert(ctx, argument)
+        user_id = int(match.group(1) or match.group(2))
+        user = discord.utils.get(ctx.message.mentions, id=user_id)
+        if user is None:
+            user = await resolver.resolve(user_id)
+        if user is None:
+            raise commands.BadArgument(f'User "{argument}" not found')
+        return user
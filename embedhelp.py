@@ -1,13 +1,34 @@
+import asyncio
+import copy
 import itertools
 import textwrap
-from typing import List
+from typing import List, Hashable, Callable
 
 import discord
 from discord.ext import commands
 
+from ttlcache import TTLCache
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
 
 class EmbedHelpCommand(commands.HelpCommand):
-    def __init__(self):
+    # check results shared across help invocations, keyed by (scope, check)
+    _shared_checks = TTLCache(ttl=0.0, maxsize=4096)
+
+    def __init__(self, check_ttl: float = 0.0):
+        """
+        :param check_ttl: time (in seconds) a check result is reused across help invocations. if 0, check results
+        are only reused within a single invocation
+        """
+        self.check_ttl = check_ttl
+        self._check_memo = dict()
         super(EmbedHelpCommand, self).__init__(verify_checks=True,
                                                command_attrs=dict(help='Provides help on the bot\'s various commands.'
                                                                        '\n'
@@ -15,6 +36,93 @@ class EmbedHelpCommand(commands.HelpCommand):
                                                                        'help for. If not specified, shows a list of '
                                                                        'all the bot\'s commands.'))
 
+    async def prepare_help_command(self, ctx, command=None):
+        self._check_memo = dict()
+        self._shared_checks.prune()
+        await super(EmbedHelpCommand, self).prepare_help_command(ctx, command)
+
+    def _check_scope(self) -> Hashable:
+        ctx = self.context
+        guild_id = None if ctx.guild is None else ctx.guild.id
+        # both the author's and the bot's, for checks like has_permissions and bot_has_permissions
+        permissions = ctx.channel.permissions_for(ctx.author).value
+        bot_permissions = ctx.channel.permissions_for(ctx.me).value
+        return ctx.author.id, guild_id, permissions, bot_permissions
+
+    @staticmethod
+    def _check_key(check: Callable) -> Hashable:
+        # checks created by the same factory with the same arguments (is_owner(), has_permissions(...), etc.)
+        # share code and closure, so they can share a result
+        code = getattr(check, '__code__', None)
+        if code is None:
+            return check
+        try:
+            key = (code, tuple(_freeze(cell.cell_contents) for cell in check.__closure__ or ()))
+            hash(key)
+        except (TypeError, ValueError):
+            return check
+        return key
+
+    async def _evaluate_check(self, check: Callable, ctx: commands.Context, shared_key: Hashable) -> bool:
+        try:
+            result = bool(await discord.utils.maybe_coroutine(check, ctx))
+        except commands.CommandError:
+            result = False
+        if self.check_ttl > 0:
+            self._shared_checks.set(shared_key, result, self.check_ttl)
+        return result
+
+    async def _run_check(self, key: Hashable, check: Callable, ctx: commands.Context) -> bool:
+        task = self._check_memo.get(key)
+        if task is None:
+            shared_key = (self._check_scope(), key)
+            cached = self._shared_checks.get(shared_key)
+            if cached is not None:
+                return cached
+            # concurrent callers await the same evaluation
+            task = self._check_memo[key] = asyncio.ensure_future(self._evaluate_check(check, ctx, shared_key))
+        return await task
+
+    async def _can_run(self, command: commands.Command) -> bool:
+        """
+        Memoized equivalent of :meth:`.Command.can_run`.
+
+        A command's own checks are still evaluated in order and short-circuit, since later checks may rely on
+        earlier ones (like :func:`.guild_only`) having passed. Like :meth:`.Command.can_run`, checks see the command
+        as ``ctx.command`` (through a copy of the context, since commands are checked concurrently). Identical checks
+        of several commands are only evaluated once, with the first of them.
+
+        :param command: command to check
+        :return: True if the command can run in the current context, False otherwise
+        """
+        if not command.enabled:
+            return False
+        ctx = copy.copy(self.context)
+        ctx.command = command
+        if not await self._run_check('__bot__', ctx.bot.can_run, ctx):
+            return False
+        cog = command.cog
+        if cog is not None:
+            local_check = commands.Cog._get_overridden_method(cog.cog_check)
+            if local_check is not None and not await self._run_check(local_check, local_check, ctx):
+                return False
+        for check in command.checks:
+            if not await self._run_check(self._check_key(check), check, ctx):
+                return False
+        return True
+
+    async def filter_commands(self, cmds, *, sort=False, key=None):
+        if sort and key is None:
+            key = lambda c: c.name
+        cmds = list(cmds if self.show_hidden else filter(lambda c: not c.hidden, cmds))
+        if not self.verify_checks:
+            return sorted(cmds, key=key) if sort else cmds
+        results = await asyncio.gather(*(self._can_run(cmd) for cmd in cmds))
+        ret = [cmd for cmd, valid in zip(cmds, results) if valid]
+        if sort:
+            ret.sort(key=key)
+        return ret
+
     def make_help_values(self, cmd_list: List[commands.Command]):
         first = True
         names = ''
@@ -81,8 +189,8 @@ class EmbedHelpCommand(commands.HelpCommand):
         if appinfo.icon is not None:
             embed.set_thumbnail(url=f'https://cdn.discordapp.com/app-icons/{appinfo.id}/{appinfo.icon}.png')
 
-        for cog, raw_cmds in mapping.items():
-            command_list = await self.filter_commands(raw_cmds, sort=True)
+        filtered = await asyncio.gather(*(self.filter_commands(raw_cmds, sort=True) for raw_cmds in mapping.values()))
+        for cog, command_list in zip(mapping.keys(), filtered):
             if len(command_list) == 0:
                 continue
             if cog is None:
@@ -102,14 +210,11 @@ class EmbedHelpCommand(commands.HelpCommand):
         await self.get_destination().send(embed=embed)
 
     async def command_can_run(self, command: commands.Command):
-        try:
-            root_parent = command.root_parent
-            if root_parent is None:
-                return await command.can_run(self.context)
-            else:
-                return await root_parent.can_run(self.context)
-        except commands.CommandError:
-            return False
+        root_parent = command.root_parent
+        if root_parent is None:
+            return await self._can_run(command)
+        else:
+            return await self._can_run(root_parent)
 
     async def send_group_help(self, group):
         if not await self.command_can_run(group):
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from typing import Optional
+
+import discord
+from discord.ext import commands
+
+from metrics import Metrics
+from ttlcache import TTLCache
+
+
+class _ErrorEntry:
+    __slots__ = ('message', 'count', 'last_edit', 'embed', 'pending')
+
+    def __init__(self):
+        self.message: Optional[discord.Message] = None
+        self.count = 1
+        self.last_edit = 0.0
+        # reply to edit in, and the edit scheduled for repeats that came in too soon after the last one
+        self.embed: Optional[discord.Embed] = None
+        self.pending: Optional[asyncio.Task] = None
+
+
+class ErrorGovernor:
+    """Throttles the bot's replies to command errors.
+
+    The first error of a given type a user runs into in a channel gets a reply as usual. Repeats within the suppression
+    window (which restarts with each repeat) update that reply with a repeat count instead of sending a new one, and
+    repeated :exc:`.CommandNotFound` errors are dropped silently. Repeats arriving too soon after the last edit are
+    folded into one trailing edit, so the count shown is never left behind.
+    """
+
+    def __init__(self, window: float = 10.0, edit_interval: float = 2.0, maxsize: int = 4096,
+                 metrics: Optional[Metrics] = None):
+        """
+        :param window: time (in seconds) repeats of an error are suppressed for
+        :param edit_interval: minimum time (in seconds) between edits of the same reply
+        :param maxsize: maximum amount of (user, channel, error type) combinations tracked at once
+        :param metrics: metrics to record sent and suppressed replies in
+        """
+        self.edit_interval = edit_interval
+        self.metrics = metrics
+        self._entries = TTLCache(ttl=window, maxsize=maxsize)
+
+    def _count(self, name: str, error_type: str):
+        if self.metrics is not None:
+            self.metrics.inc(name, dict(type=error_type))
+
+    async def reply(self, ctx: commands.Context, exception: Exception, embed: discord.Embed):
+        """
+        Replies to a command error, unless it's a repeat.
+
+        :param ctx: context the error occurred in
+        :param exception: the error
+        :param embed: reply to send
+        """
+        error_type = type(exception).__name__
+        key = (ctx.author.id, ctx.channel.id, error_type)
+        entry: Optional[_ErrorEntry] = self._entries.get(key)
+        if entry is None:
+            # registered before sending, so errors arriving while the reply is in flight count as repeats
+            entry = _ErrorEntry()
+            self._entries.set(key, entry)
+            self._count('leobot_error_replies_sent_total', error_type)
+            replies = getattr(ctx.bot, 'replies', None)
+            try:
+                if replies is None:
+                    entry.message = await ctx.send(embed=embed)
+                else:
+                    entry.message = await replies.send(ctx, embed=embed)
+            except discord.HTTPException:
+                # nothing to count repeats on, so the next error gets a reply of its own
+                if self._entries.get(key) is entry:
+                    self._entries.pop(key)
+                raise
+            return
+        entry.count += 1
+        self._entries.set(key, entry)
+        self._count('leobot_error_replies_suppressed_total', error_type)
+        if isinstance(exception, commands.CommandNotFound) or entry.message is None:
+            return
+        entry.embed = embed
+        if entry.pending is not None:
+            return
+        delay = entry.last_edit + self.edit_interval - time.monotonic()
+        if delay > 0:
+            entry.pending = asyncio.ensure_future(self._edit_later(entry, delay))
+            return
+        try:
+            await self._edit(entry)
+        except discord.HTTPException:
+            pass
+
+    async def _edit(self, entry: _ErrorEntry):
+        entry.last_edit = time.monotonic()
+        entry.embed.set_footer(text=f'(repeated {entry.count} times)')
+        await entry.message.edit(embed=entry.embed)
+
+    async def _edit_later(self, entry: _ErrorEntry, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            # cleared before editing, so repeats arriving during the edit schedule another one
+            entry.pending = None
+        try:
+            await self._edit(entry)
+        except discord.HTTPException:
+            # like a deleted reply. nobody awaits this task, so it must not fail
+            pass
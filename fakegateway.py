@@ -0,0 +1,282 @@
+import asyncio
+import itertools
+import re
+from collections import deque
+from functools import partial
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Union
+
+import discord
+from discord.ext import commands
+
+_MENTION_PATTERN = re.compile(r'<@!?([0-9]+)>')
+_snowflakes = itertools.count(100000000000000000)
+
+
+class FakeUser:
+    """Stands in for a :class:`.User` (or a :class:`.Member`, when it belongs to a guild)."""
+
+    def __init__(self, user_id: int, name: Optional[str] = None, discriminator: str = '0001', bot: bool = False,
+                 guild: Optional['FakeGuild'] = None):
+        self.id = user_id
+        self.name = f'User{user_id}' if name is None else name
+        self.discriminator = discriminator
+        self.bot = bot
+        self.guild = guild
+        self.avatar = None
+
+    @property
+    def display_name(self) -> str:
+        return self.name
+
+    @property
+    def mention(self) -> str:
+        return f'<@{self.id}>'
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+    def __eq__(self, other):
+        return hasattr(other, 'id') and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeGuild:
+    """Stands in for a :class:`.Guild`."""
+
+    def __init__(self, guild_id: int, owner: FakeUser, me: FakeUser, name: Optional[str] = None):
+        self.id = guild_id
+        self.name = f'Guild{guild_id}' if name is None else name
+        self.owner = owner
+        self.owner_id = owner.id
+        self.me = me
+        self.members: Dict[int, FakeUser] = dict()
+
+    def get_member(self, user_id: int) -> Optional[FakeUser]:
+        return self.members.get(user_id)
+
+    async def kick(self, user, *, reason=None):
+        self.members.pop(user.id, None)
+
+    async def ban(self, user, *, reason=None, delete_message_days=1):
+        self.members.pop(user.id, None)
+
+    async def unban(self, user, *, reason=None):
+        pass
+
+
+class FakeMessage:
+    """Stands in for a :class:`.Message`."""
+
+    def __init__(self, state, channel: 'FakeChannel', author: Union[FakeUser, discord.ClientUser], content: str = '',
+                 embed: Optional[discord.Embed] = None, file: Optional[discord.File] = None,
+                 mentions: Optional[List[FakeUser]] = None):
+        self._state = state
+        self.id = next(_snowflakes)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embeds = [] if embed is None else [embed]
+        self.file = file
+        self.mentions = [] if mentions is None else mentions
+
+    async def edit(self, *, content: Optional[str] = None, embed: Optional[discord.Embed] = None, **kwargs):
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [embed]
+
+    async def delete(self, **kwargs):
+        pass
+
+
+class FakeChannel:
+    """Stands in for a :class:`.TextChannel` (or a :class:`.DMChannel`, if it doesn't belong to a guild).
+
+    Messages sent to it are kept in :attr:`sent`.
+    """
+
+    def __init__(self, state, channel_id: int, guild: Optional[FakeGuild] = None,
+                 permissions: Optional[discord.Permissions] = None, history: int = 100):
+        """
+        :param state: the bot's connection state
+        :param channel_id: ID of the channel
+        :param guild: guild the channel belongs to. if None, the channel is a DM channel
+        :param permissions: permissions every user has in the channel
+        :param history: amount of sent messages to keep
+        """
+        self._state = state
+        self.id = channel_id
+        self.guild = guild
+        if permissions is None:
+            permissions = discord.Permissions.text() if guild is None else discord.Permissions.general()
+        self.permissions = permissions
+        self.sent = deque(maxlen=history)
+        self.sent_count = 0
+
+    def permissions_for(self, member) -> discord.Permissions:
+        if self.guild is not None and member.id == self.guild.owner_id:
+            return discord.Permissions.all()
+        return self.permissions
+
+    async def send(self, content=None, *, embed=None, file=None, **kwargs) -> FakeMessage:
+        message = FakeMessage(self._state, self, self._state.user, '' if content is None else str(content), embed,
+                              file)
+        self.sent.append(message)
+        self.sent_count += 1
+        return message
+
+    async def purge(self, *, limit=100, before=None, **kwargs):
+        return []
+
+
+class FakeContext(commands.Context):
+    """A :class:`.Context` whose replies go to a :class:`FakeChannel` instead of Discord."""
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def trigger_typing(self):
+        pass
+
+
+class FakeGateway:
+    """Stands in for Discord's gateway, so the bot can be run locally without logging in.
+
+    Once installed, :meth:`.Client.start` (and therefore :meth:`.Client.run`) skips logging in and connecting, fires
+    the ``connect`` and ``ready`` events and then idles until the bot is closed. User lookups and application info
+    are answered locally, and messages can be fed to the bot with :meth:`send_message`.
+    """
+
+    def __init__(self, bot: commands.Bot, poll_interval: float = 0.1, owner_id: int = 1, bot_id: int = 2,
+                 api_latency: float = 0.0):
+        """
+        :param bot: bot to run
+        :param poll_interval: how often (in seconds) to check whether the bot has been closed
+        :param owner_id: ID of the bot's owner
+        :param bot_id: ID of the bot's own user
+        :param api_latency: simulated time (in seconds) an API call takes
+        """
+        self.bot = bot
+        self.poll_interval = poll_interval
+        self.owner_id = owner_id
+        self.bot_id = bot_id
+        self.api_latency = api_latency
+        self.api_calls = 0
+        self.users: Dict[int, FakeUser] = dict()
+        self.guilds: Dict[int, FakeGuild] = dict()
+        self._dm_channels: Dict[int, FakeChannel] = dict()
+
+    @property
+    def state(self):
+        return self.bot._connection
+
+    def install(self):
+        """Replaces the bot's network-facing methods with fake ones."""
+        bot = self.bot
+        bot.login = self._login
+        bot.connect = self._connect
+        bot.get_user = self.users.get
+        bot.fetch_user = self._fetch_user
+        bot.application_info = self._application_info
+        bot.get_context = partial(type(bot).get_context, bot, cls=FakeContext)
+        bot.owner_id = self.owner_id
+        self.state.user = discord.ClientUser(state=self.state, data=dict(id=self.bot_id, username='LeoBot',
+                                                                         discriminator='0000', avatar=None,
+                                                                         bot=True))
+        self.user(self.owner_id, 'Owner')
+
+    async def _login(self, *args, **kwargs):
+        pass
+
+    async def _connect(self, *args, **kwargs):
+        self.bot.dispatch('connect')
+        self.bot.dispatch('ready')
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.poll_interval)
+
+    async def _fetch_user(self, user_id: int) -> FakeUser:
+        self.api_calls += 1
+        if self.api_latency > 0:
+            await asyncio.sleep(self.api_latency)
+        return FakeUser(user_id)
+
+    async def _application_info(self):
+        return SimpleNamespace(id=self.bot_id, name='LeoBot', description='', icon=None,
+                               owner=self.users.get(self.owner_id))
+
+    def user(self, user_id: int, name: Optional[str] = None) -> FakeUser:
+        """
+        Retrieves a user in the gateway cache, adding it if it doesn't exist.
+
+        :param user_id: ID of the user
+        :param name: name of the user, if it's added
+        :return: the user
+        """
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = FakeUser(user_id, name)
+        return user
+
+    def guild(self, guild_id: int) -> FakeGuild:
+        """
+        Retrieves a guild, adding it if it doesn't exist. New guilds are owned by the bot's owner.
+
+        :param guild_id: ID of the guild
+        :return: the guild
+        """
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = FakeGuild(guild_id, self.user(self.owner_id), self.state.user)
+        return guild
+
+    def channel(self, guild: Optional[FakeGuild] = None, channel_id: Optional[int] = None,
+                history: Optional[int] = 100) -> FakeChannel:
+        """
+        Creates a channel.
+
+        :param guild: guild the channel belongs to. if None, creates a DM channel
+        :param channel_id: ID of the channel. if None, generates one
+        :param history: amount of sent messages to keep. if None, keeps all of them
+        :return: the channel
+        """
+        return FakeChannel(self.state, next(_snowflakes) if channel_id is None else channel_id, guild,
+                           history=history)
+
+    def dm_channel(self, user: FakeUser) -> FakeChannel:
+        """
+        Retrieves the DM channel with a user, creating it if it doesn't exist.
+
+        :param user: the user
+        :return: the channel
+        """
+        channel = self._dm_channels.get(user.id)
+        if channel is None:
+            channel = self._dm_channels[user.id] = self.channel()
+        return channel
+
+    async def send_message(self, author: FakeUser, channel: FakeChannel, content: str) -> FakeMessage:
+        """
+        Feeds a message to the bot's command handling, and waits until it has been handled.
+
+        :param author: author of the message
+        :param channel: channel the message is sent in
+        :param content: content of the message (including the command prefix)
+        :return: the message
+        """
+        if channel.guild is not None:
+            channel.guild.members.setdefault(author.id, author)
+        mentions = []
+        for match in _MENTION_PATTERN.finditer(content):
+            user = self.users.get(int(match.group(1)))
+            if user is not None:
+                mentions.append(user)
+        message = FakeMessage(self.state, channel, author, content, mentions=mentions)
+        await self.bot.process_commands(message)
+        return message
@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+
+def _write_temp(file_name: str, text: str) -> str:
+    # a unique temporary file, so concurrent writers of the same file can't clobber each other's halves
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(file_name) or '.', prefix=f'{os.path.basename(file_name)}.',
+                                     suffix='.tmp')
+    f = os.fdopen(fd, 'w')
+    try:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+    except BaseException:
+        f.close()
+        os.remove(temp_file)
+        raise
+    return temp_file
+
+
+def write_json_atomic(file_name: str, data: Any):
+    """
+    Writes data to a JSON file, so that the file holds either its old or its new contents at any moment (even if the
+    process is killed mid-write).
+
+    :param file_name: file to write to
+    :param data: data to write
+    """
+    temp_file = _write_temp(file_name, json.dumps(data))
+    try:
+        os.replace(temp_file, file_name)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+class StagedWrite(NamedTuple):
+    key: Hashable
+    file_name: str
+    seq: int
+    # serialized contents, or None to remove the file
+    text: Optional[str]
+
+
+class JsonFileWriter:
+    """Writes JSON files atomically (like :func:`write_json_atomic`), from any thread.
+
+    Contents are serialized when they're staged, on the event loop where they're modified, and written later, possibly
+    by several worker threads at once. If a file is staged again before its earlier contents are written, only the
+    latest contents end up in it, so a flush finishing late can't overwrite a newer one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # file name -> sequence number of its most recently staged contents, until they're written
+        self._latest: Dict[str, int] = dict()
+        self._seq = itertools.count()
+
+    def stage(self, key: Hashable, file_name: str, data: Any) -> StagedWrite:
+        """
+        Serializes contents to write to a file.
+
+        :param key: key to report the write under
+        :param file_name: file to write to
+        :param data: data to write, or None to remove the file
+        :return: the staged write, to pass to :meth:`write`
+        """
+        text = None if data is None else json.dumps(data)
+        with self._lock:
+            seq = next(self._seq)
+            self._latest[file_name] = seq
+        return StagedWrite(key, file_name, seq, text)
+
+    def _settle(self, staged: StagedWrite, temp_file: Optional[str]) -> bool:
+        with self._lock:
+            if self._latest.get(staged.file_name) != staged.seq:
+                # superseded by newer contents, which are written by whoever staged them
+                if temp_file is not None:
+                    os.remove(temp_file)
+                return False
+            try:
+                if temp_file is not None:
+                    os.replace(temp_file, staged.file_name)
+                elif os.path.exists(staged.file_name):
+                    os.remove(staged.file_name)
+            except OSError:
+                if temp_file is not None and os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+            del self._latest[staged.file_name]
+            return True
+
+    def _forget(self, staged: StagedWrite):
+        with self._lock:
+            if self._latest.get(staged.file_name) == staged.seq:
+                del self._latest[staged.file_name]
+
+    def write(self, staged: List[StagedWrite],
+              deadline: Optional[float] = None) -> Tuple[List[Hashable], List[Hashable]]:
+        """
+        Writes staged contents. Blocks, so it should be run in a worker thread unless there's little to write.
+
+        :param staged: writes staged with :meth:`stage`
+        :param deadline: :func:`time.monotonic` value after which no more files are written. if None, writes every file
+        :return: keys of the writes that were persisted (or superseded by newer contents), and keys of the writes that
+        weren't
+        """
+        persisted = []
+        not_persisted = []
+        for item in staged:
+            if deadline is not None and time.monotonic() >= deadline:
+                self._forget(item)
+                not_persisted.append(item.key)
+                continue
+            try:
+                temp_file = None
+                if item.text is not None:
+                    os.makedirs(os.path.dirname(item.file_name) or '.', exist_ok=True)
+                    temp_file = _write_temp(item.file_name, item.text)
+                self._settle(item, temp_file)
+            except OSError:
+                self._forget(item)
+                not_persisted.append(item.key)
+            else:
+                persisted.append(item.key)
+        return persisted, not_persisted
+
+    async def write_async(self, staged: List[StagedWrite], deadline: Optional[float] = None,
+                          workers: int = 4) -> Tuple[List[Hashable], List[Hashable]]:
+        """
+        Writes staged contents with several worker threads at once, so slow syncs to disk overlap.
+
+        :param staged: writes staged with :meth:`stage`
+        :param deadline: :func:`time.monotonic` value after which no more files are written. if None, writes every file
+        :param workers: amount of worker threads to write with
+        :return: keys of the writes that were persisted (or superseded by newer contents), and keys of the writes that
+        weren't
+        """
+        loop = asyncio.get_event_loop()
+        chunks = [staged[i::workers] for i in range(min(workers, len(staged)))]
+        results = await asyncio.gather(*(loop.run_in_executor(None, self.write, chunk, deadline) for chunk in chunks))
+        persisted = []
+        not_persisted = []
+        for chunk_persisted, chunk_not_persisted in results:
+            persisted += chunk_persisted
+            not_persisted += chunk_not_persisted
+        return persisted, not_persisted
@@ -0,0 +1,107 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from discord.ext import commands
+
+Coercer = Callable[[Any], Any]
+
+
+class Setting(NamedTuple):
+    name: str
+    coerce: Coercer
+    default: Any
+    description: str
+    owner: Optional[str]
+
+
+def coerce_bool(value: Any) -> bool:
+    """
+    Coerces a config value (or command argument) to a bool.
+
+    :raises commands.BadArgument: if the value isn't a bool
+    """
+    if isinstance(value, bool):
+        return value
+    lowered = str(value).lower()
+    if lowered in ('yes', 'y', 'true', 't', '1', 'enable', 'on'):
+        return True
+    if lowered in ('no', 'n', 'false', 'f', '0', 'disable', 'off'):
+        return False
+    raise commands.BadArgument(f'"{value}" is not a boolean')
+
+
+def coerce_str_list(value: Any) -> Optional[List[str]]:
+    """
+    Coerces a config value (or command argument, split on whitespace) to a list of strings.
+
+    :return: the list, or None if the value is None
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.split()
+    return [str(item) for item in value]
+
+
+class SettingsSchema:
+    """Schema of the typed per-guild settings that cogs register, compiled from guild configs.
+
+    Every schema change creates a new ``__slots__`` class to compile configs into, so objects compiled with an older
+    schema can be told apart by their class.
+    """
+
+    def __init__(self):
+        self._settings: Dict[str, Setting] = dict()
+        self.cls = self._make_class()
+
+    def _make_class(self) -> type:
+        return type('GuildSettings', (), dict(__slots__=tuple(self._settings)))
+
+    def register(self, name: str, coerce: Coercer, default: Any, description: str = '', owner: Optional[str] = None):
+        """
+        Registers a setting. Registering an existing setting replaces it.
+
+        :param name: name of the setting, which is also its config key and attribute name
+        :param coerce: function converting a raw config value to the setting's type, raising ValueError, TypeError or
+        commands.BadArgument if it can't
+        :param default: value of the setting in guilds that don't set it (or set it to an invalid value)
+        :param description: what the setting does
+        :param owner: name of the cog that registered the setting
+        """
+        self._settings[name] = Setting(name, coerce, default, description, owner)
+        self.cls = self._make_class()
+
+    def unregister_owner(self, owner: str):
+        """
+        Unregisters all settings registered by a cog.
+
+        :param owner: name of the cog
+        """
+        names = [name for name, setting in self._settings.items() if setting.owner == owner]
+        for name in names:
+            del self._settings[name]
+        if len(names) > 0:
+            self.cls = self._make_class()
+
+    def get(self, name: str) -> Optional[Setting]:
+        return self._settings.get(name)
+
+    def settings(self) -> List[Setting]:
+        return list(self._settings.values())
+
+    def compile(self, config: Dict[str, Any]) -> Any:
+        """
+        Compiles a guild's config.
+
+        :param config: the guild's config
+        :return: object with an attribute for each registered setting
+        """
+        compiled = self.cls()
+        for name, setting in self._settings.items():
+            value = setting.default
+            if name in config:
+                try:
+                    value = setting.coerce(config[name])
+                except (ValueError, TypeError, commands.BadArgument):
+                    pass
+            setattr(compiled, name, value)
+        return compiled
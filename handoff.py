@@ -0,0 +1,79 @@
+import sys
+import traceback
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+
+class StateHandoff:
+    """Hands state over from an extension's outgoing cog to its incoming cog when the extension is reloaded.
+
+    Before reloading an extension, call :meth:`expect`. While unloading, the outgoing cog can then :meth:`park` its
+    caches (instead of flushing them), and the incoming cog can :meth:`adopt` them, provided it understands the schema
+    version they were parked with. Once the reload is done, call :meth:`finish`: state nobody adopted (because the
+    schema version changed, or the reload failed) is flushed with the flush function it was parked with.
+    """
+
+    def __init__(self):
+        self._expected: Set[str] = set()
+        self._parked: Dict[str, Tuple[int, Any, Optional[Callable[[], Any]]]] = dict()
+
+    def expect(self, ext: str):
+        """
+        Marks an extension as about to be reloaded.
+
+        :param ext: extension that is about to be reloaded
+        """
+        self._expected.add(ext)
+
+    def expecting(self, ext: str) -> bool:
+        """
+        :param ext: extension to check
+        :return: True if the extension is being reloaded, False otherwise
+        """
+        return ext in self._expected
+
+    def park(self, key: str, version: int, state: Any, flush: Optional[Callable[[], Any]] = None):
+        """
+        Parks state to be adopted by an incoming cog.
+
+        :param key: key to park the state under (usually the cog's name)
+        :param version: schema version of the state
+        :param state: state to park
+        :param flush: function that persists the state, called if nobody adopts it
+        """
+        self._parked[key] = (version, state, flush)
+
+    def adopt(self, key: str, version: int) -> Optional[Any]:
+        """
+        Adopts parked state.
+
+        :param key: key the state was parked under
+        :param version: schema version the caller understands
+        :return: the state, or None if there is none (or if it was parked with a different schema version, in which
+        case it is left to :meth:`finish` to flush)
+        """
+        parked = self._parked.get(key)
+        if parked is None or parked[0] != version:
+            return None
+        del self._parked[key]
+        return parked[1]
+
+    def finish(self, ext: str):
+        """
+        Marks a reload as done, flushing state that wasn't adopted.
+
+        :param ext: extension that was reloaded
+        """
+        self._expected.discard(ext)
+        if len(self._expected) > 0:
+            return
+        parked = self._parked
+        self._parked = dict()
+        for key, (version, _, flush) in parked.items():
+            if flush is None:
+                continue
+            print(f'State of "{key}" (schema version {version}) wasn\'t adopted, flushing it.', file=sys.stderr)
+            try:
+                flush()
+            except Exception as e:
+                print(f'Failed to flush state of "{key}".', file=sys.stderr)
+                traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
@@ -1,19 +1,171 @@
+import time
+
+# measured as early as possible, so the startup report includes the time spent importing
+_startup_origin = time.perf_counter()
+
+import asyncio
 import sys
 import traceback
+from typing import Optional
 
 import discord
 from discord.ext import commands
 
 import settings
+from converters import UserResolver
 from embedhelp import EmbedHelpCommand
+from errorgovernor import ErrorGovernor
+from handoff import StateHandoff
+from loadshedding import AdmissionController, Overloaded
+from metrics import Metrics
+from replies import ReplyPipeline
+from shutdown import ShutdownCoordinator
+from startup import StartupReport
+from traffic import TraceRecorder
 
 
 class LeoBot(commands.AutoShardedBot):
+    def __init__(self, *args, **kwargs):
+        self.startup = StartupReport(kwargs.pop('startup_origin', None))
+        super(LeoBot, self).__init__(*args, **kwargs)
+        self._connect_start = None
+        self.cluster = None
+        self.handoff = StateHandoff()
+        self.shutdown = ShutdownCoordinator(self, settings.shutdown_deadline, settings.shutdown_drain_timeout)
+        self.user_resolver = UserResolver(self, settings.user_cache_ttl, settings.user_cache_negative_ttl,
+                                          settings.user_cache_size)
+        self.trace_recorder = None
+        if settings.trace_file is not None:
+            self.trace_recorder = TraceRecorder(settings.trace_file, settings.trace_salt)
+        self.replies = ReplyPipeline(settings.reply_rate, settings.reply_rate_per, settings.reply_attachment_threshold)
+        self._lazy_commands = dict()
+        for ext, names in settings.lazy_extensions.items():
+            for name in names:
+                self._lazy_commands[name] = ext
+        self.metrics = Metrics()
+        self.metrics.describe('leobot_command_latency_seconds', 'Time taken to invoke a command.')
+        self.metrics.describe('leobot_command_errors_total', 'Command errors, by exception type.')
+        self.metrics.describe('leobot_event_loop_lag_seconds', 'Most recently sampled event loop lag.')
+        self.metrics.register_gauge('leobot_cached_guilds', lambda: len(self.guilds))
+        self.metrics.register_gauge('leobot_cached_users', lambda: len(self.users))
+        self.metrics.register_gauge('leobot_user_resolver_cached_ids', lambda: len(self.user_resolver))
+        self.metrics.register_gauge('leobot_startup_phase_seconds', self._startup_phases)
+        self.metrics.describe('leobot_error_replies_suppressed_total', 'Error replies suppressed as repeats.')
+        self.error_governor = ErrorGovernor(settings.error_reply_window, settings.error_reply_edit_interval,
+                                            metrics=self.metrics)
+        self.metrics.describe('leobot_commands_shed_total', 'Commands rejected because the bot was overloaded.')
+        self.admission = AdmissionController(settings.shed_priorities, settings.shed_default_priority,
+                                             settings.shed_lag_thresholds, settings.shed_in_flight_thresholds,
+                                             metrics=self.metrics)
+
+    def _startup_phases(self):
+        phases = dict(self.startup.phases)
+        if self.startup.finished:
+            phases['total'] = self.startup.total
+        return phases
+
+    def load_extension_timed(self, name: str, phase: Optional[str] = None) -> bool:
+        """
+        Loads an extension, recording the time it took in the startup report.
+
+        Failures are printed to stderr instead of being raised.
+
+        :param name: extension to load
+        :param phase: name of the phase to record. if None, uses "load <name>"
+        :return: True if the extension was loaded, False otherwise
+        """
+        try:
+            with self.startup.phase(f'load {name}' if phase is None else phase):
+                self.load_extension(name)
+        except commands.ExtensionError as e:
+            print(f'Failed to load extension "{name}".', file=sys.stderr)
+            traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+            return False
+        return True
+
+    async def login(self, *args, **kwargs):
+        with self.startup.phase('login'):
+            await super(LeoBot, self).login(*args, **kwargs)
+
+    async def connect(self, *args, **kwargs):
+        if self._connect_start is None:
+            self._connect_start = time.perf_counter()
+        await super(LeoBot, self).connect(*args, **kwargs)
+
+    async def start(self, *args, **kwargs):
+        self.shutdown.install_signal_handlers()
+        self.metrics.start_lag_monitor(settings.metrics_lag_interval)
+        if settings.metrics_http_port is not None:
+            await self.metrics.serve(settings.metrics_http_host, settings.metrics_http_port)
+        await super(LeoBot, self).start(*args, **kwargs)
+
+    async def close(self):
+        self.metrics.stop()
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
+        await super(LeoBot, self).close()
+
+    async def process_commands(self, message):
+        if message.author.bot or not self.shutdown.accepting:
+            return
+        ctx = await self.get_context(message)
+        if ctx.command is None and ctx.invoked_with in self._lazy_commands:
+            ext = self._lazy_commands[ctx.invoked_with]
+            for name in settings.lazy_extensions[ext]:
+                self._lazy_commands.pop(name, None)
+            if self.load_extension_timed(ext, f'load {ext} (lazy)'):
+                ctx = await self.get_context(message)
+        if not await self.admission.admit(ctx, self.metrics.gauge_value('leobot_event_loop_lag_seconds'),
+                                          self.shutdown.in_flight):
+            self.dispatch('command_error', ctx, Overloaded('The bot is overloaded right now, please try again later.'))
+            return
+        await self.invoke(ctx)
+
+    async def invoke(self, ctx):
+        start = time.perf_counter()
+        self.shutdown.in_flight += 1
+        try:
+            if self.cluster is None:
+                await super(LeoBot, self).invoke(ctx)
+            else:
+                with self.cluster.store.transaction():
+                    await super(LeoBot, self).invoke(ctx)
+        finally:
+            self.shutdown.in_flight -= 1
+            if ctx.command is not None:
+                self.metrics.observe('leobot_command_latency_seconds', time.perf_counter() - start,
+                                     dict(command=ctx.command.qualified_name))
+                if self.trace_recorder is not None:
+                    self.trace_recorder.record(ctx, start)
+
     async def on_ready(self):
-        print(f'Logged on as {self.user}! (id: {self.user.id})')
+        if self.user is not None:
+            print(f'Logged on as {self.user}! (id: {self.user.id})')
+        if not self.startup.finished:
+            if self._connect_start is not None:
+                self.startup.record('shards ready', time.perf_counter() - self._connect_start)
+            system = self.get_cog('System')
+            if settings.startup_warm_configs and system is not None:
+                with self.startup.phase('config cache warm-up'):
+                    for guild in self.guilds:
+                        # read-only: config_load would mark every config as changed
+                        system.guild_settings(guild)
+            self.startup.finish()
+            for ext in settings.deferred_extensions:
+                # let pending events through between loads
+                await asyncio.sleep(0)
+                self.load_extension_timed(ext, f'load {ext} (deferred)')
+            unknown = self.admission.unknown_cogs(self.cogs)
+            if len(unknown) > 0:
+                print(f'Warning: load shedding priorities are set for unknown cogs: {", ".join(unknown)}. Unless they '
+                      f'are loaded lazily, check settings.shed_priorities.', file=sys.stderr)
+            print('Startup report:')
+            for line in self.startup.lines():
+                print(f'  {line}')
         print('Ready for operation!')
 
     async def on_command_error(self, context, exception):
+        self.metrics.inc('leobot_command_errors_total', dict(type=type(exception).__name__))
         color = discord.Color.dark_red()
         title = ':x: **_ERROR!!!_**'
         description = str(exception)
@@ -22,39 +174,64 @@ class LeoBot(commands.AutoShardedBot):
             title = ':snowflake: **_CHILL!!!_**'
         elif isinstance(exception, commands.CheckFailure):
             title = ':no_entry_sign: **_NO WAY!!!_**'
+        elif isinstance(exception, Overloaded):
+            color = discord.Color.orange()
+            title = ':hourglass: **_BUSY!!!_**'
         elif not isinstance(exception, commands.CommandNotFound):
             print('Exception in command "{}":'.format(context.command.qualified_name), file=sys.stderr)
             traceback.print_exception(type(exception), exception, exception.__traceback__, file=sys.stderr)
         embed = discord.Embed(color=color,
                               title=title,
                               description=description)
-        await context.send(embed=embed)
+        await self.error_governor.reply(context, exception, embed)
 
 
 async def get_prefix(bot: commands.Bot, message: discord.Message):
     extras = settings.prefixes
+    mention_prefix = settings.mention_prefix
     if settings.prefixes_dm is not None and isinstance(message.channel, (discord.DMChannel, discord.GroupChannel)):
         extras = settings.prefixes_dm
-    if settings.mention_prefix:
+    elif message.guild is not None:
+        system = bot.get_cog('System')
+        if system is not None:
+            guild_settings = system.guild_settings(message.guild)
+            if guild_settings.prefixes is not None:
+                extras = guild_settings.prefixes
+            mention_prefix = guild_settings.mention_prefix
+    if mention_prefix:
         return commands.when_mentioned_or(*extras)(bot, message)
     else:
         return extras
 
 
-if __name__ == '__main__':
-    _bot = LeoBot(command_prefix=get_prefix, help_command=EmbedHelpCommand())
-    try:
-        _bot.load_extension('cogs.system')
-    except commands.ExtensionError as e:
+def create_bot(**kwargs) -> LeoBot:
+    """
+    Creates the bot and loads the startup extensions.
+
+    Exits if the essential extension "cogs.system" fails to load.
+
+    :param kwargs: extra options to pass to :class:`LeoBot` (like ``shard_ids`` and ``shard_count``)
+    :return: the bot
+    """
+    bot = LeoBot(command_prefix=get_prefix, help_command=EmbedHelpCommand(check_ttl=settings.help_check_ttl),
+                 startup_origin=_startup_origin, **kwargs)
+    bot.startup.record('imports', time.perf_counter() - _startup_origin)
+    if not bot.load_extension_timed('cogs.system'):
         print('Failed to load essential extension "cogs.system".', file=sys.stderr)
-        traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
         exit(-1)
     for ext in settings.startup_extensions:
-        try:
-            _bot.load_extension(ext)
-        except commands.ExtensionError as e:
-            print(f'Failed to load extension "{ext}".', file=sys.stderr)
-            traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+        bot.load_extension_timed(ext)
+    return bot
+
+
+def read_token() -> str:
+    """
+    Reads the bot account token from the .token file.
+
+    Exits if the file can't be opened.
+
+    :return: the token
+    """
     try:
         f = open('.token')
     except OSError as e:
@@ -62,6 +239,11 @@ if __name__ == '__main__':
         traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
         exit(-1)
     else:
-        _token = f.readline()
+        token = f.readline()
         f.close()
-        _bot.run(_token)
+        return token
+
+
+if __name__ == '__main__':
+    _bot = create_bot()
+    _bot.run(read_token())
@@ -0,0 +1,83 @@
+from typing import Dict, Iterable, List, Optional
+
+from discord.ext import commands
+
+from metrics import Metrics
+
+
+class Overloaded(commands.CommandError):
+    """Raised (through ``on_command_error``) for commands rejected because the bot is overloaded."""
+    pass
+
+
+class AdmissionController:
+    """Decides which commands to run when the bot falls behind.
+
+    Every command has a priority class: 0 for the owner's commands and for commands of critical cogs (never rejected),
+    and higher numbers for less important ones. Each class above 0 has an event loop lag threshold and an in-flight
+    command threshold: once either is crossed, commands of that class (and any less important class) are rejected
+    until load drops again.
+    """
+
+    def __init__(self, priorities: Dict[str, int], default_priority: int, lag_thresholds: Dict[int, float],
+                 in_flight_thresholds: Dict[int, int], metrics: Optional[Metrics] = None):
+        """
+        :param priorities: cog name -> priority class of its commands
+        :param default_priority: priority class of commands of other cogs (and of commands without a cog)
+        :param lag_thresholds: priority class -> event loop lag (in seconds) above which its commands are rejected
+        :param in_flight_thresholds: priority class -> commands in flight above which its commands are rejected
+        :param metrics: metrics to record rejected commands in
+        """
+        self.priorities = priorities
+        self.default_priority = default_priority
+        self.lag_thresholds = lag_thresholds
+        self.in_flight_thresholds = in_flight_thresholds
+        self.metrics = metrics
+        # lowest thresholds of any class, to admit everything quickly while the bot keeps up
+        self._min_lag = min(lag_thresholds.values(), default=float('inf'))
+        self._min_in_flight = min(in_flight_thresholds.values(), default=float('inf'))
+
+    def unknown_cogs(self, cog_names: Iterable[str]) -> List[str]:
+        """
+        :param cog_names: names of the loaded cogs
+        :return: names with a priority that aren't among them (likely typos, whose commands get the default priority)
+        """
+        cog_names = set(cog_names)
+        return sorted(name for name in self.priorities if name not in cog_names)
+
+    def shed_from(self, lag: float, in_flight: int) -> Optional[int]:
+        """
+        :param lag: current event loop lag (in seconds)
+        :param in_flight: amount of commands currently in flight
+        :return: the most important priority class whose commands are currently rejected, or None if none are
+        """
+        if lag <= self._min_lag and in_flight <= self._min_in_flight:
+            return None
+        shed = None
+        for priority in set(self.lag_thresholds) | set(self.in_flight_thresholds):
+            if priority <= 0:
+                continue
+            if lag > self.lag_thresholds.get(priority, float('inf')) \
+                    or in_flight > self.in_flight_thresholds.get(priority, float('inf')):
+                shed = priority if shed is None else min(shed, priority)
+        return shed
+
+    async def admit(self, ctx: commands.Context, lag: float, in_flight: int) -> bool:
+        """
+        Decides whether to run a command.
+
+        :param ctx: context of the command
+        :param lag: current event loop lag (in seconds)
+        :param in_flight: amount of commands currently in flight
+        :return: True if the command should run, False if it should be rejected
+        """
+        shed = self.shed_from(lag, in_flight)
+        if shed is None or ctx.command is None:
+            return True
+        cog = ctx.command.cog_name
+        priority = self.priorities.get(cog, self.default_priority)
+        if priority < shed or await ctx.bot.is_owner(ctx.author):
+            return True
+        if self.metrics is not None:
+            self.metrics.inc('leobot_commands_shed_total', dict(priority=str(priority), cog=str(cog)))
+        return False
@@ -0,0 +1,160 @@
+import gc
+import itertools
+import os
+import sys
+import tracemalloc
+import types
+from collections import deque
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# never followed: they're shared by everything, and aren't data
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 types.CodeType, types.FrameType)
+
+
+class CacheSize(NamedTuple):
+    name: str
+    entries: int
+    size: int
+    estimated: bool
+
+
+def _referents(obj: Any) -> Iterable[Any]:
+    if isinstance(obj, Mapping):
+        # includes weak dictionaries, whose values wouldn't be reached through their attributes
+        return itertools.chain.from_iterable(obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return obj
+    referents = []
+    if hasattr(obj, '__dict__'):
+        referents.append(vars(obj))
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            if hasattr(obj, slot):
+                referents.append(getattr(obj, slot))
+    return referents
+
+
+def deep_size(obj: Any, exclude: Optional[Set[int]] = None, sample: int = 1000) -> Tuple[int, bool]:
+    """
+    Estimates the memory used by an object and everything it references.
+
+    Containers with more than ``sample`` items are estimated from their first ``sample`` items, so the cost stays
+    bounded for large caches. Raises RuntimeError if a container changes size while it's measured (when measuring
+    from a worker thread).
+
+    :param obj: object to measure
+    :param exclude: IDs of objects not to follow (like the bot itself, which most cached objects reference)
+    :param sample: maximum amount of items of each container to measure
+    :return: size (in bytes), and whether it's an estimate
+    """
+    seen = set() if exclude is None else set(exclude)
+    estimated = False
+    total = 0
+    # (object, weight) pairs: the weight scales the sizes of objects reached through sampled containers
+    stack = [(obj, 1.0)]
+    while len(stack) > 0:
+        current, weight = stack.pop()
+        if id(current) in seen or isinstance(current, _OPAQUE_TYPES):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current) * weight
+        if isinstance(current, (str, bytes, int, float, bool, type(None))):
+            continue
+        referents = _referents(current)
+        if isinstance(current, (Mapping, list, tuple, set, frozenset, deque)) and len(current) > sample:
+            # mappings yield a key and a value per item
+            referents = itertools.islice(referents, sample * 2 if isinstance(current, Mapping) else sample)
+            weight *= len(current) / sample
+            estimated = True
+        for referent in referents:
+            stack.append((referent, weight))
+    return int(total), estimated
+
+
+def cache_sizes(caches: Dict[str, Any], exclude: Set[int], sample: int = 1000, attempts: int = 3) -> List[CacheSize]:
+    """
+    Measures named caches.
+
+    Meant to be run in a worker thread while the caches are in use: a cache that changes size while it's measured is
+    measured again, and left out if that keeps happening.
+
+    :param caches: name -> cache (anything with a length)
+    :param exclude: IDs of objects not to follow
+    :param sample: maximum amount of items of each container to measure
+    :param attempts: times to try measuring each cache
+    :return: size of each cache
+    """
+    sizes = []
+    for name, cache in caches.items():
+        for _ in range(attempts):
+            try:
+                size, estimated = deep_size(cache, exclude, sample)
+            except RuntimeError:
+                continue
+            sizes.append(CacheSize(name, len(cache), size, estimated))
+            break
+    return sizes
+
+
+def live_instances(classes: Iterable[type]) -> Dict[str, int]:
+    """
+    Counts the live instances of classes (and their subclasses), to spot leaks. Walks every object tracked by the
+    garbage collector, so it's slow with a large heap, and should be run in a worker thread.
+
+    :param classes: classes to count
+    :return: class name -> amount of instances
+    """
+    classes = tuple(classes)
+    counts = {cls.__name__: 0 for cls in classes}
+    for obj in gc.get_objects():
+        for cls in classes:
+            if isinstance(obj, cls):
+                counts[cls.__name__] += 1
+    return counts
+
+
+def current_rss() -> Optional[int]:
+    """
+    :return: current resident set size (in bytes), or None if it can't be read on this platform
+    """
+    try:
+        f = open('/proc/self/statm', 'r')
+    except OSError:
+        return None
+    pages = int(f.read().split()[1])
+    f.close()
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """
+    Takes a tracemalloc snapshot, leaving out allocations made by tracemalloc and the import system.
+
+    :return: the snapshot
+    """
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+
+
+def top_growth(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, limit: int = 15) -> List[str]:
+    """
+    Compares two tracemalloc snapshots by allocation site.
+
+    :param old: earlier snapshot
+    :param new: later snapshot
+    :param limit: maximum amount of allocation sites to return
+    :return: lines describing the allocation sites that grew the most
+    """
+    lines = []
+    stats = sorted(new.compare_to(old, 'lineno'), key=lambda stat: stat.size_diff, reverse=True)
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f'{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  '
+                     f'{frame.filename}:{frame.lineno}')
+    return lines
@@ -0,0 +1,303 @@
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+Labels = Tuple[Tuple[str, str], ...]
+GaugeValue = Union[float, Dict[str, float]]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    """A cumulative histogram with fixed bucket bounds."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count', 'max')
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile from the bucket counts.
+
+        :param q: quantile to estimate, between 0 and 1
+        :return: upper bound of the bucket the quantile falls in (or the maximum observed value, if it falls in the
+        overflow bucket)
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+
+class Metrics:
+    """Registry of the bot's counters, gauges and histograms."""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[Labels, float]] = dict()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = dict()
+        self._gauges: Dict[str, Dict[Labels, float]] = dict()
+        self._gauge_funcs: Dict[str, Callable[[], GaugeValue]] = dict()
+        self._help: Dict[str, str] = dict()
+        self._lag_task: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def describe(self, name: str, text: str):
+        """
+        Sets the help text of a metric.
+
+        :param name: metric name
+        :param text: help text
+        """
+        self._help[name] = text
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, amount: float = 1):
+        """
+        Increments a counter.
+
+        :param name: counter name
+        :param labels: counter labels
+        :param amount: amount to increment by
+        """
+        series = self._counters.setdefault(name, dict())
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        """
+        Sets the value of a gauge.
+
+        :param name: gauge name
+        :param value: new value
+        :param labels: gauge labels
+        """
+        self._gauges.setdefault(name, dict())[_labels(labels)] = value
+
+    def register_gauge(self, name: str, func: Callable[[], GaugeValue]):
+        """
+        Registers a gauge whose value is computed when metrics are collected.
+
+        :param name: gauge name
+        :param func: function returning either the gauge's value, or a dict of label value -> gauge value
+        (labelled as ``key``)
+        """
+        self._gauge_funcs[name] = func
+
+    def unregister_gauge(self, name: str):
+        """
+        Unregisters a gauge registered with :meth:`register_gauge`.
+
+        :param name: gauge name
+        """
+        self._gauge_funcs.pop(name, None)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Records a value in a histogram.
+
+        :param name: histogram name
+        :param value: value to record
+        :param labels: histogram labels
+        :param bounds: bucket bounds, used if the histogram doesn't exist yet
+        """
+        series = self._histograms.setdefault(name, dict())
+        key = _labels(labels)
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram(bounds)
+        hist.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, labels: Optional[Dict[str, str]] = None) -> Iterator[None]:
+        """
+        Context manager that records its duration (in seconds) in a histogram.
+
+        :param name: histogram name
+        :param labels: histogram labels
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def clear(self, name: str):
+        """
+        Resets a metric, removing all of its recorded values.
+
+        :param name: metric name
+        """
+        self._counters.pop(name, None)
+        self._gauges.pop(name, None)
+        self._histograms.pop(name, None)
+
+    def counter_value(self, name: str, labels: Optional[Dict[str, str]] = None) -> float:
+        return self._counters.get(name, dict()).get(_labels(labels), 0)
+
+    def counter_total(self, name: str) -> float:
+        return sum(self._counters.get(name, dict()).values())
+
+    def gauge_value(self, name: str, labels: Optional[Dict[str, str]] = None) -> float:
+        return self._gauges.get(name, dict()).get(_labels(labels), 0.0)
+
+    def histogram(self, name: str, labels: Optional[Dict[str, str]] = None) -> Optional[Histogram]:
+        return self._histograms.get(name, dict()).get(_labels(labels))
+
+    def _collect_gauges(self) -> Dict[str, Dict[Labels, float]]:
+        gauges = {name: dict(series) for name, series in self._gauges.items()}
+        for name, func in list(self._gauge_funcs.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            if isinstance(value, dict):
+                gauges[name] = {(('key', str(k)),): v for k, v in value.items()}
+            else:
+                gauges[name] = {(): value}
+        return gauges
+
+    def render_prometheus(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        :return: rendered metrics
+        """
+        lines = []
+
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for name, series in sorted(self._counters.items()):
+            header(name, 'counter')
+            for labels, value in series.items():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        for name, series in sorted(self._collect_gauges().items()):
+            header(name, 'gauge')
+            for labels, value in series.items():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        for name, series in sorted(self._histograms.items()):
+            header(name, 'histogram')
+            for labels, hist in series.items():
+                cumulative = 0
+                for bound, count in zip(hist.bounds, hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {hist.count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {hist.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> List[str]:
+        """
+        Summarizes all metrics in a human-readable form.
+
+        :return: summary lines
+        """
+        lines = []
+        for name, series in sorted(self._counters.items()):
+            for labels, value in sorted(series.items()):
+                lines.append(f'{name}{_format_labels(labels)} = {value:g}')
+        for name, series in sorted(self._collect_gauges().items()):
+            for labels, value in sorted(series.items()):
+                lines.append(f'{name}{_format_labels(labels)} = {value:g}')
+        for name, series in sorted(self._histograms.items()):
+            for labels, hist in sorted(series.items()):
+                lines.append(f'{name}{_format_labels(labels)}: n={hist.count} '
+                             f'avg={hist.sum / hist.count if hist.count else 0:.4f} '
+                             f'p50<={hist.quantile(0.5):g} p99<={hist.quantile(0.99):g} max={hist.max:.4f}')
+        return lines
+
+    async def _sample_lag(self, interval: float):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.set_gauge('leobot_event_loop_lag_seconds', lag)
+            self.observe('leobot_event_loop_lag_seconds_hist', lag)
+
+    def start_lag_monitor(self, interval: float = 1.0):
+        """
+        Starts the background task that samples event loop lag.
+
+        :param interval: time (in seconds) between samples
+        """
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.ensure_future(self._sample_lag(interval))
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # discard the request headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status = '200 OK'
+                body = self.render_prometheus().encode('utf-8')
+            else:
+                status = '404 Not Found'
+                body = b'not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\n'
+                         f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        """
+        Starts serving metrics over HTTP, in the Prometheus text format, at ``/metrics``.
+
+        :param host: host to bind to
+        :param port: port to bind to
+        """
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle_http, host, port)
+
+    def stop(self):
+        """Stops the event loop lag sampler and the HTTP endpoint."""
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+def _frame_label(code) -> str:
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class SamplingProfiler:
+    """A statistical profiler that periodically samples the stacks of running threads from a background thread.
+
+    Since it never hooks into the interpreter, the profiled code keeps running at (almost) full speed.
+    """
+
+    def __init__(self, interval: float = 0.005, all_threads: bool = False):
+        """
+        :param interval: time (in seconds) between samples
+        :param all_threads: if True, samples every thread. otherwise, only samples the thread that starts the profiler
+        (the event loop's thread, usually)
+        """
+        self.interval = interval
+        self.all_threads = all_threads
+        # amount of stacks sampled (one per sampled thread per tick)
+        self.samples = 0
+        self._labels = dict()
+        self._target_id: Optional[int] = None
+        self._stacks = Counter()
+        self._self_counts = Counter()
+        self._total_counts = Counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts sampling."""
+        if self.running:
+            raise RuntimeError('Profiler is already running')
+        self._target_id = None if self.all_threads else threading.get_ident()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling. Collected samples are kept."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _label(self, code) -> str:
+        # building labels is the costliest part of sampling, and the same functions show up again and again
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            if self._target_id is not None:
+                frames = {self._target_id: frames[self._target_id]} if self._target_id in frames else dict()
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                stack.reverse()
+                self._stacks[(names.get(thread_id, str(thread_id)),) + tuple(stack)] += 1
+                self._self_counts[stack[-1]] += 1
+                for label in set(stack):
+                    self._total_counts[label] += 1
+                self.samples += 1
+
+    def top(self, n: int = 15) -> List[Tuple[str, int, int]]:
+        """
+        Retrieves the hottest functions, by the amount of samples they were executing in.
+
+        :param n: amount of functions to retrieve
+        :return: list of (function, self samples, total samples). divided by :attr:`samples`, these are fractions of
+        the sampled stacks
+        """
+        return [(label, count, self._total_counts[label]) for label, count in self._self_counts.most_common(n)]
+
+    def collapsed(self) -> Dict[str, int]:
+        """
+        Retrieves the collected stacks in the collapsed format used by flame graph tools.
+
+        :return: dict of collapsed stack -> sample count
+        """
+        return {';'.join(stack): count for stack, count in self._stacks.items()}
+
+    def write_collapsed(self, file_name: str):
+        """
+        Writes the collected stacks to a file, in the collapsed format used by flame graph tools.
+
+        :param file_name: file to write to
+        """
+        dir_name = os.path.dirname(file_name)
+        if dir_name != '':
+            os.makedirs(dir_name, exist_ok=True)
+        f = open(file_name, 'w')
+        for stack, count in sorted(self.collapsed().items()):
+            f.write(f'{stack} {count}\n')
+        f.close()
@@ -0,0 +1,172 @@
+"""Replays a recorded traffic trace (see :class:`traffic.TraceRecorder`) against the cogs, through a fake gateway.
+
+Events are fired at their recorded arrival times, scaled by the replay speed, whether or not earlier events have
+finished. When the bot can't keep up, events start late: the reported dispatch lag and event loop lag show at what
+speed the event loop saturates.
+
+Run ``python replay.py --help`` for usage.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from bench import create_bench_bot, max_rss, snowflake, summarize, percentile
+from fakegateway import FakeChannel, FakeGateway, FakeUser
+from leobot import LeoBot
+from traffic import TraceEvent, arrival_offsets, read_trace, synthesize_args
+
+
+class _TraceWorld:
+    """Maps a trace's hashed users and guilds to fake ones."""
+
+    def __init__(self, gateway: FakeGateway, events: List[TraceEvent]):
+        self.gateway = gateway
+        # snowflake-sized, so ID arguments take the same converter path as recorded ones
+        self._ids = (snowflake(60000 + i) for i in itertools.count())
+        self.users: Dict[str, FakeUser] = dict()
+        self.channels: Dict[str, FakeChannel] = dict()
+        for event in events:
+            self.user(event)
+        self.user_ids = [user.id for user in self.users.values()]
+
+    def user(self, event: TraceEvent) -> FakeUser:
+        if event.owner:
+            return self.gateway.user(self.gateway.owner_id)
+        user = self.users.get(event.user)
+        if user is None:
+            user = self.users[event.user] = self.gateway.user(next(self._ids))
+        return user
+
+    def channel(self, event: TraceEvent, author: FakeUser) -> FakeChannel:
+        if event.scope == 'dm':
+            return self.gateway.dm_channel(author)
+        channel = self.channels.get(event.scope)
+        if channel is None:
+            channel = self.channels[event.scope] = self.gateway.channel(self.gateway.guild(next(self._ids)))
+        return channel
+
+
+async def replay(bot: LeoBot, gateway: FakeGateway, events: List[TraceEvent], speed: Optional[float],
+                 concurrency: int = 100, seed: int = 0) -> Dict[str, Any]:
+    """
+    Replays a trace.
+
+    :param bot: bot to replay the trace against
+    :param gateway: the bot's gateway
+    :param events: the trace's events
+    :param speed: replay speed (1 for real time). if None, fires events as fast as possible, keeping at most
+    concurrency events in flight
+    :param concurrency: maximum amount of events in flight when replaying as fast as possible
+    :param seed: seed for making up command arguments
+    :return: replay results
+    """
+    bot.metrics.clear('leobot_event_loop_lag_seconds_hist')
+    world = _TraceWorld(gateway, events)
+    rng = random.Random(seed)
+    offsets = arrival_offsets(events)
+    limiter = asyncio.Semaphore(concurrency) if speed is None else None
+    latencies = []
+    dispatch_lags = []
+    pending = set()
+
+    async def fire(author, channel, content):
+        try:
+            start = time.perf_counter()
+            await gateway.send_message(author, channel, content)
+            latencies.append(time.perf_counter() - start)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    for i in sorted(range(len(events)), key=offsets.__getitem__):
+        event = events[i]
+        if limiter is not None:
+            await limiter.acquire()
+        else:
+            target = start + offsets[i] / speed
+            delay = target - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            dispatch_lags.append(max(0.0, loop.time() - target))
+        author = world.user(event)
+        content = f'!{event.command} {synthesize_args(event.shapes, rng, world.user_ids)}'.rstrip()
+        task = asyncio.ensure_future(fire(author, world.channel(event, author), content))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    await asyncio.gather(*pending)
+    result = summarize(latencies, loop.time() - start)
+    dispatch_lags.sort()
+    result['speed'] = 'max' if speed is None else speed
+    result['dispatch_lag_ms'] = dict(p50=percentile(dispatch_lags, 0.5) * 1000,
+                                     p99=percentile(dispatch_lags, 0.99) * 1000,
+                                     max=(dispatch_lags[-1] if len(dispatch_lags) > 0 else 0.0) * 1000)
+    lag = bot.metrics.histogram('leobot_event_loop_lag_seconds_hist')
+    if lag is not None:
+        result['event_loop_lag_ms'] = dict(p99=lag.quantile(0.99) * 1000, max=lag.max * 1000)
+    result['max_rss_bytes'] = max_rss()
+    return result
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Replays a recorded traffic trace against the bot\'s cogs.')
+    parser.add_argument('trace', help='trace file to replay')
+    parser.add_argument('--speed', nargs='+', default=['1'],
+                        help='replay speeds to run, one after another: multipliers like 1 or 10, or "max" '
+                             '(default: 1)')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='maximum events in flight at "max" speed (default: 100)')
+    parser.add_argument('--include-system', action='store_true',
+                        help='also replay "system" commands (which may shut the bot down, take profiles, etc.)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for making up command arguments (default: 0)')
+    parser.add_argument('--output', default=None, help='file to write results to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    events = [event for event in read_trace(args.trace)
+              if args.include_system or not event.command.startswith('system')]
+    speeds = [None if speed == 'max' else float(speed) for speed in args.speed]
+
+    work_dir = tempfile.mkdtemp(prefix='leobot-replay-')
+    old_cwd = os.getcwd()
+    os.chdir(work_dir)
+    os.makedirs('configs', exist_ok=True)
+    results = []
+    try:
+        bot, gateway = create_bench_bot()
+        try:
+            bot.metrics.start_lag_monitor(0.05)
+            for speed in speeds:
+                result = bot.loop.run_until_complete(replay(bot, gateway, events, speed, args.concurrency,
+                                                            args.seed))
+                results.append(result)
+                print(f'speed {result["speed"]}: {result["ops_per_sec"]:.1f} ops/sec, '
+                      f'p99 latency {result["latency_ms"]["p99"]:.3f} ms, '
+                      f'p99 dispatch lag {result["dispatch_lag_ms"]["p99"]:.3f} ms', file=sys.stderr)
+        finally:
+            for ext in reversed(list(bot.extensions)):
+                bot.unload_extension(ext)
+            bot.loop.run_until_complete(bot.close())
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(dict(trace=args.trace, events=len(events), results=results), indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        f = open(args.output, 'w')
+        f.write(text)
+        f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import asyncio
+import io
+import time
+from collections import deque
+from typing import Dict, Hashable, List, Optional
+
+import discord
+from discord.ext import commands
+
+MESSAGE_LIMIT = 2000
+
+
+def pack_messages(header: str, pages: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Packs a header and paginator pages into as few messages as possible.
+
+    :param header: text to send before the pages
+    :param pages: pages to send
+    :param limit: maximum length of a message
+    :return: messages to send
+    """
+    messages = []
+    current = header.rstrip('\n')
+    for page in pages:
+        if current == '':
+            current = page
+        elif len(current) + 1 + len(page) <= limit:
+            current += '\n' + page
+        else:
+            messages.append(current)
+            current = page
+    if current != '':
+        messages.append(current)
+    return messages
+
+
+def _page_text(pag: commands.Paginator) -> str:
+    prefix = pag.prefix or ''
+    suffix = pag.suffix or ''
+    lines = []
+    for page in pag.pages:
+        lines.append(page[len(prefix):len(page) - len(suffix)].strip('\n'))
+    return '\n'.join(lines)
+
+
+class _ChannelBucket:
+    __slots__ = ('lock', 'sent', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.sent = deque()
+        # amount of senders holding or waiting for the lock
+        self.users = 0
+
+
+class ReplyPipeline:
+    """Sends the bot's replies through a queue per channel, pacing them to stay within the channel's rate limit
+    instead of running into 429s, and packs paginated output into as few messages as possible.
+
+    Only replies sent through the pipeline are paced: paginated output (:func:`send_pages`) and error replies. Plain
+    ``ctx.send`` calls bypass it, and are left to discord.py's own rate limit handling.
+    """
+
+    def __init__(self, rate: int = 5, per: float = 5.0, attachment_threshold: int = 3 * MESSAGE_LIMIT,
+                 maxsize: int = 4096):
+        """
+        :param rate: amount of messages that can be sent to a channel...
+        :param per: ...per this amount of seconds
+        :param attachment_threshold: paginated output longer than this is sent as an attached text file instead
+        :param maxsize: amount of channels tracked before idle ones are dropped
+        """
+        self.rate = rate
+        self.per = per
+        self.attachment_threshold = attachment_threshold
+        self.maxsize = maxsize
+        self._buckets: Dict[Hashable, _ChannelBucket] = dict()
+        self._prune_at = maxsize
+
+    def _prune(self):
+        # buckets in use (or still limiting their channel) are kept, so a channel never has two queues at once
+        now = time.monotonic()
+        idle = [key for key, bucket in self._buckets.items()
+                if bucket.users == 0 and (len(bucket.sent) == 0 or now - bucket.sent[-1] >= self.per)]
+        for key in idle:
+            del self._buckets[key]
+        self._prune_at = max(self.maxsize, 2 * len(self._buckets))
+
+    async def send(self, destination: discord.abc.Messageable, *args, **kwargs) -> discord.Message:
+        """
+        Sends a message through the destination channel's queue.
+
+        :param destination: where to send the message. usually a :class:`.Context`
+        :return: the sent message
+        """
+        channel = getattr(destination, 'channel', destination)
+        key = getattr(channel, 'id', id(channel))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune()
+            bucket = self._buckets[key] = _ChannelBucket()
+        bucket.users += 1
+        try:
+            async with bucket.lock:
+                now = time.monotonic()
+                while len(bucket.sent) > 0 and now - bucket.sent[0] >= self.per:
+                    bucket.sent.popleft()
+                if len(bucket.sent) >= self.rate:
+                    await asyncio.sleep(self.per - (now - bucket.sent[0]))
+                    bucket.sent.popleft()
+                message = await destination.send(*args, **kwargs)
+                bucket.sent.append(time.monotonic())
+                return message
+        finally:
+            bucket.users -= 1
+
+    async def send_pages(self, destination: discord.abc.Messageable, header: str, pag: commands.Paginator,
+                         file_name: str = 'output.txt'):
+        """
+        Sends a header followed by a paginator's pages, in as few messages as possible.
+
+        :param destination: where to send the output. usually a :class:`.Context`
+        :param header: text to send before the pages
+        :param pag: paginator holding the output
+        :param file_name: name of the attached file, if the output is too long to be sent as messages
+        """
+        pages = pag.pages
+        if sum(len(page) for page in pages) > self.attachment_threshold:
+            text = _page_text(pag).encode('utf-8')
+            await self.send(destination, header, file=discord.File(io.BytesIO(text), filename=file_name))
+            return
+        for message in pack_messages(header, pages):
+            await self.send(destination, message)
+
+
+async def send_pages(ctx: commands.Context, header: str, pag: commands.Paginator,
+                     file_name: Optional[str] = None):
+    """
+    Sends a header followed by a paginator's pages through the bot's :class:`ReplyPipeline`, in as few messages as
+    possible.
+
+    If the bot doesn't have a reply pipeline, the packed messages are sent directly.
+
+    :param ctx: context to reply to
+    :param header: text to send before the pages
+    :param pag: paginator holding the output
+    :param file_name: name of the attached file, if the output is too long to be sent as messages
+    """
+    pipeline: Optional[ReplyPipeline] = getattr(ctx.bot, 'replies', None)
+    if pipeline is not None:
+        if file_name is None:
+            await pipeline.send_pages(ctx, header, pag)
+        else:
+            await pipeline.send_pages(ctx, header, pag, file_name)
+        return
+    for message in pack_messages(header, pag.pages):
+        await ctx.send(message)
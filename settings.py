@@ -5,6 +5,13 @@ startup_extensions = [
     'cogs.economy',
     'cogs.gambling',
 ]
+# Extensions to load once the bot is ready, instead of before logging in
+deferred_extensions = []
+# Extensions to load when one of their commands is first used, mapped to the names (and aliases) of those commands
+# (their commands won't show up in the help command until then)
+lazy_extensions = {}
+# Should the configurations of all guilds be read (and their settings compiled) on startup?
+startup_warm_configs = False
 
 # Command prefixes
 prefixes = ['!']
@@ -12,3 +19,62 @@ prefixes = ['!']
 prefixes_dm = None
 # Should a mention be considered a command prefix?
 mention_prefix = True
+
+# How long (in seconds) help command check results are reused across invocations (set to 0 to disable)
+help_check_ttl = 0.0
+
+# How often (in seconds) event loop lag is sampled for metrics
+metrics_lag_interval = 1.0
+# Host and port to serve Prometheus metrics on (set port to None to disable the HTTP endpoint)
+metrics_http_host = '127.0.0.1'
+metrics_http_port = None
+
+# Amount of replies the bot sends to a channel per this amount of seconds, before it starts pacing them
+reply_rate = 5
+reply_rate_per = 5.0
+# Paginated replies longer than this amount of characters are sent as an attached text file
+reply_attachment_threshold = 6000
+
+# Time (in seconds) repeats of the same error by the same user in the same channel get no new reply for
+error_reply_window = 10.0
+# Minimum time (in seconds) between updates of an error reply's repeat count
+error_reply_edit_interval = 2.0
+
+# Time (in seconds) users looked up through the API are cached for, and time unknown user IDs are cached for
+user_cache_ttl = 600.0
+user_cache_negative_ttl = 60.0
+# Maximum amount of user IDs cached at once
+user_cache_size = 10000
+
+# File to record anonymized command invocations to, for replaying with replay.py (set to None to disable)
+trace_file = None
+# Salt for hashing user and guild IDs in traces (set to None to use a random salt every run)
+trace_salt = None
+
+# Time (in seconds) a shutdown (via the exit command or SIGTERM) may take, including flushing unsaved data
+shutdown_deadline = 10.0
+# Maximum time (in seconds) a shutdown waits for running commands to finish before flushing
+shutdown_drain_timeout = 5.0
+
+# Directory snapshots of the configurations and data stores are written to
+snapshot_dir = 'snapshots'
+# Time (in hours) between scheduled snapshots (set to None to disable scheduled snapshots)
+snapshot_interval = None
+# Every this many scheduled snapshots is a full one; the others only include what changed since the previous snapshot
+snapshot_full_every = 24
+
+# Time (in hours) between compactions of the data stores, which remove empty stores and move dormant ones to the cold
+# tier (set to None to disable scheduled compactions)
+userdata_compact_interval = 6.0
+# Data stores untouched for this amount of days are moved to the (gzipped) cold tier (set to None to never move them)
+userdata_cold_after = 30.0
+
+# Priority class of each cog's commands (by cog name) when the bot is overloaded: 0 is never rejected, higher numbers
+# are rejected sooner. The owner's commands are never rejected
+shed_priorities = {'System': 0, 'UserData': 0, 'Administration': 0, 'Economy': 1, 'Gambling': 2}
+# Priority class of commands of other cogs (and of commands without a cog, like help)
+shed_default_priority = 2
+# Event loop lag (in seconds) above which commands of each priority class (and less important ones) are rejected
+shed_lag_thresholds = {1: 2.0, 2: 0.5}
+# Commands in flight above which commands of each priority class (and less important ones) are rejected
+shed_in_flight_thresholds = {1: 500, 2: 200}
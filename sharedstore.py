@@ -0,0 +1,294 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import path
+from typing import Dict, Any, AnyStr, Iterable, Iterator, List, Optional, Set, Tuple
+
+from discord.ext import commands
+
+StoreDict = Dict[AnyStr, Any]
+StoreKey = Tuple[str, str]
+
+# keys of the stores held by the current command invocation
+_held_keys: ContextVar[Optional[Set[StoreKey]]] = ContextVar('held_keys', default=None)
+
+
+class StoreBusy(commands.CommandError):
+    """Exception raised when a store is currently owned by another worker process.
+
+    This inherits from :exc:`CommandError`
+    """
+    pass
+
+
+class SharedStore:
+    """A data store shared between the worker processes of a cluster, backed by SQLite.
+
+    To prevent workers from overwriting each other's changes, each store has an owner: a worker acquires ownership of a
+    store when a command first loads it, and gives it back (writing the store's data) once every command holding it
+    has finished. While a store is owned, other workers can't load it for writing, and their commands fail with
+    :exc:`StoreBusy` instead. Ownership lapses after a lease period, in case its owner dies without releasing it, so
+    :meth:`renew_leases` must run while stores are held.
+
+    All database access happens in order on a dedicated thread, so the event loop never waits on SQLite's locks or
+    fsyncs, except when a command loads a store that wasn't acquired ahead of time with :meth:`acquire`.
+    """
+
+    def __init__(self, file_name: str, owner: int, lease: float = 30.0, legacy_dir: str = 'userdata',
+                 busy_timeout: float = 5.0, blocking_timeout: float = 0.25):
+        """
+        :param file_name: SQLite database file
+        :param owner: ID of this worker
+        :param lease: time (in seconds) ownership of a store lasts before it lapses
+        :param legacy_dir: directory holding JSON data stores to import stores from, if they don't exist yet
+        :param busy_timeout: maximum time (in seconds) to wait for another worker's database lock
+        :param blocking_timeout: like busy_timeout, but for loads that block the event loop
+        """
+        dir_name = path.dirname(file_name)
+        if dir_name != '':
+            os.makedirs(dir_name, exist_ok=True)
+        self.owner = owner
+        self.lease = lease
+        self.legacy_dir = legacy_dir
+        self.busy_timeout = busy_timeout
+        self.blocking_timeout = blocking_timeout
+        # store key -> [data, amount of commands holding it]
+        self._held: Dict[StoreKey, list] = dict()
+        # store key -> amount of acquisitions running in the background
+        self._acquiring: Dict[StoreKey, int] = dict()
+        # keys of stores released while being acquired in the background, whose acquired data is outdated
+        self._stale: Set[StoreKey] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='SharedStore')
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._connect, file_name).result()
+
+    def _connect(self, file_name: str):
+        # SQLite connections may only be used by the thread that created them
+        self._db = sqlite3.connect(file_name, timeout=self.busy_timeout, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS stores ('
+                         'scope TEXT NOT NULL, '
+                         'key TEXT NOT NULL, '
+                         'data TEXT NOT NULL, '
+                         'owner INTEGER, '
+                         'lease_until REAL NOT NULL DEFAULT 0, '
+                         'PRIMARY KEY (scope, key))')
+
+    def close(self):
+        """Releases every held store and closes the database."""
+        if len(self._held) > 0:
+            self._submit_write({key: data for key, (data, _) in self._held.items()})
+            self._held.clear()
+        self._executor.submit(self._db.close).result()
+        self._executor.shutdown()
+
+    def _legacy_data(self, scope: str, key: str) -> str:
+        legacy_file = f'{self.legacy_dir}/{scope}/{key}.json'
+        if path.exists(legacy_file):
+            f = open(legacy_file, 'r')
+            data = f.read()
+            f.close()
+            return data
+        return '{}'
+
+    def _read(self, scope: str, key: str) -> StoreDict:
+        row = self._db.execute('SELECT data FROM stores WHERE scope = ? AND key = ?', (scope, key)).fetchone()
+        return json.loads(self._legacy_data(scope, key) if row is None else row[0])
+
+    def read(self, scope: str, key: str) -> StoreDict:
+        """
+        Reads a store without acquiring ownership of it. Changes made to the returned data are not persisted.
+
+        :param scope: store scope
+        :param key: store key
+        :return: store data
+        """
+        held = self._held.get((scope, key))
+        if held is not None:
+            return held[0]
+        return self._executor.submit(self._read, scope, key).result()
+
+    def _acquire(self, scope: str, key: str, busy_timeout: float) -> StoreDict:
+        now = time.time()
+        self._db.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}')
+        try:
+            self._db.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            # another worker is holding the database lock
+            raise StoreBusy('That data is being used elsewhere right now. Please try again in a moment.')
+        try:
+            row = self._db.execute('SELECT data, owner, lease_until FROM stores WHERE scope = ? AND key = ?',
+                                   (scope, key)).fetchone()
+            if row is None:
+                data = self._legacy_data(scope, key)
+                self._db.execute('INSERT INTO stores (scope, key, data, owner, lease_until) VALUES (?, ?, ?, ?, ?)',
+                                 (scope, key, data, self.owner, now + self.lease))
+            else:
+                data, owner, lease_until = row
+                if owner is not None and owner != self.owner and lease_until > now:
+                    raise StoreBusy('That data is being used elsewhere right now. Please try again in a moment.')
+                self._db.execute('UPDATE stores SET owner = ?, lease_until = ? WHERE scope = ? AND key = ?',
+                                 (self.owner, now + self.lease, scope, key))
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        return json.loads(data)
+
+    def _write(self, stores: Dict[StoreKey, StoreDict]):
+        lost = []
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            for (scope, key), data in stores.items():
+                cur = self._db.execute('UPDATE stores SET data = ?, owner = NULL, lease_until = 0 '
+                                       'WHERE scope = ? AND key = ? AND owner = ?',
+                                       (json.dumps(data), scope, key, self.owner))
+                if cur.rowcount == 0:
+                    lost.append(f'{scope}/{key}')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        if len(lost) > 0:
+            print(f'Lost ownership of shared stores before writing them: {", ".join(lost)}', file=sys.stderr)
+
+    def _submit_write(self, stores: Dict[StoreKey, StoreDict]):
+        # serialized now, since the data may change again before the write runs
+        serialized = {store_key: json.loads(json.dumps(data)) for store_key, data in stores.items()}
+        future = self._executor.submit(self._write, serialized)
+        future.add_done_callback(self._report_write)
+
+    @staticmethod
+    def _report_write(future: Future):
+        e = future.exception()
+        if e is not None:
+            print(f'Failed to write shared stores: {e!r}', file=sys.stderr)
+
+    def _renew(self, store_keys: List[StoreKey]) -> List[StoreKey]:
+        lost = []
+        until = time.time() + self.lease
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            for scope, key in store_keys:
+                cur = self._db.execute('UPDATE stores SET lease_until = ? WHERE scope = ? AND key = ? AND owner = ?',
+                                       (until, scope, key, self.owner))
+                if cur.rowcount == 0:
+                    lost.append((scope, key))
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        return lost
+
+    async def renew_leases(self):
+        """Renews the leases of the held stores every third of the lease period, for as long as it runs."""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            store_keys = list(self._held)
+            if len(store_keys) == 0:
+                continue
+            try:
+                lost = await loop.run_in_executor(self._executor, self._renew, store_keys)
+            except sqlite3.Error as e:
+                print(f'Failed to renew shared store leases: {e!r}', file=sys.stderr)
+                continue
+            if len(lost) > 0:
+                print(f'Lost ownership of held shared stores: {", ".join(f"{s}/{k}" for s, k in lost)}',
+                      file=sys.stderr)
+
+    def _hold(self, store_key: StoreKey, held_keys: Set[StoreKey], data: Optional[StoreDict] = None) -> StoreDict:
+        held = self._held.get(store_key)
+        if held is None:
+            held = self._held[store_key] = [data, 0]
+        held[1] += 1
+        held_keys.add(store_key)
+        return held[0]
+
+    async def acquire(self, store_keys: Iterable[StoreKey]):
+        """
+        Acquires stores for the current :meth:`transaction` ahead of time, without blocking the event loop, so loading
+        them later doesn't block it either.
+
+        :param store_keys: (scope, key) of each store
+        :raises StoreBusy: if a store is owned by another worker
+        """
+        held_keys = _held_keys.get()
+        if held_keys is None:
+            return
+        loop = asyncio.get_event_loop()
+        for store_key in store_keys:
+            if store_key in held_keys:
+                continue
+            if store_key in self._held:
+                self._hold(store_key, held_keys)
+                continue
+            self._acquiring[store_key] = self._acquiring.get(store_key, 0) + 1
+            try:
+                while True:
+                    self._stale.discard(store_key)
+                    data = await loop.run_in_executor(self._executor, self._acquire, store_key[0], store_key[1],
+                                                      self.busy_timeout)
+                    # another command may have acquired (and maybe released) it in the meantime
+                    if store_key in self._held or store_key not in self._stale:
+                        break
+            finally:
+                self._acquiring[store_key] -= 1
+                if self._acquiring[store_key] == 0:
+                    del self._acquiring[store_key]
+                    self._stale.discard(store_key)
+            self._hold(store_key, held_keys, data)
+
+    def load(self, scope: str, key: str) -> StoreDict:
+        """
+        Loads a store for writing.
+
+        If called outside of :meth:`transaction`, this behaves like :meth:`read`.
+
+        :param scope: store scope
+        :param key: store key
+        :return: store data
+        """
+        held_keys = _held_keys.get()
+        if held_keys is None:
+            return self.read(scope, key)
+        store_key = (scope, key)
+        if store_key in held_keys:
+            return self._held[store_key][0]
+        data = None
+        if store_key not in self._held:
+            # not acquired ahead of time, so this blocks the event loop (briefly)
+            data = self._executor.submit(self._acquire, scope, key, self.blocking_timeout).result()
+        return self._hold(store_key, held_keys, data)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Context manager that holds every store loaded inside of it, releasing them when it exits.
+
+        Stores are released once no transaction is holding them anymore.
+        """
+        held_keys = set()
+        token = _held_keys.set(held_keys)
+        try:
+            yield
+        finally:
+            _held_keys.reset(token)
+            to_write = dict()
+            for store_key in held_keys:
+                held = self._held[store_key]
+                held[1] -= 1
+                if held[1] == 0:
+                    to_write[store_key] = held[0]
+                    del self._held[store_key]
+                    if store_key in self._acquiring:
+                        self._stale.add(store_key)
+            if len(to_write) > 0:
+                # written in order before any later acquisition, so the event loop doesn't have to wait for it
+                self._submit_write(to_write)
@@ -0,0 +1,112 @@
+import asyncio
+import signal
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from discord.ext import commands
+
+# takes a time.monotonic() deadline, returns the keys that were persisted and the keys that weren't
+FlushFunc = Callable[[Optional[float]], Awaitable[Tuple[List[str], List[str]]]]
+
+
+class ShutdownCoordinator:
+    """Shuts the bot down within a deadline.
+
+    Once a shutdown starts, new commands are ignored, commands in flight are given some time to finish, and then every
+    registered storage service stops its background flushing and flushes its dirty data, all at once, until the
+    deadline passes. What was and wasn't persisted is logged.
+    """
+
+    def __init__(self, bot: commands.Bot, deadline: float = 10.0, drain_timeout: float = 5.0):
+        """
+        :param bot: bot to shut down
+        :param deadline: time (in seconds) the whole shutdown may take
+        :param drain_timeout: maximum time (in seconds) to wait for commands in flight to finish
+        """
+        self.bot = bot
+        self.deadline = deadline
+        self.drain_timeout = drain_timeout
+        self.accepting = True
+        self.in_flight = 0
+        self._storages: Dict[str, Tuple[FlushFunc, Optional[Callable[[], None]]]] = dict()
+        self._task: Optional[asyncio.Future] = None
+
+    def register_storage(self, name: str, flush: FlushFunc, stop: Optional[Callable[[], None]] = None):
+        """
+        Registers a storage service to flush on shutdown.
+
+        :param name: name of the service
+        :param flush: coroutine function that flushes the service's dirty data (capturing it on the event loop, and
+        writing it in worker threads)
+        :param stop: function that stops the service's background tasks that write its data, called before flushing
+        """
+        self._storages[name] = (flush, stop)
+
+    def unregister_storage(self, name: str):
+        """
+        Unregisters a storage service registered with :meth:`register_storage`.
+
+        :param name: name of the service
+        """
+        self._storages.pop(name, None)
+
+    def install_signal_handlers(self):
+        """Makes SIGTERM start a shutdown."""
+        try:
+            self.bot.loop.add_signal_handler(signal.SIGTERM, self.begin, 'SIGTERM')
+        except (NotImplementedError, RuntimeError):
+            # not supported on this platform
+            pass
+
+    def begin(self, reason: str = 'requested', from_command: bool = False) -> asyncio.Future:
+        """
+        Starts shutting down, if that hasn't started yet.
+
+        :param reason: why the bot is shutting down
+        :param from_command: True if called from a command, which then isn't waited for
+        :return: future that finishes once the bot is closed
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.shutdown(reason, from_command))
+        return self._task
+
+    async def _drain(self, allowance: int, timeout: float):
+        end = time.monotonic() + timeout
+        while self.in_flight > allowance and time.monotonic() < end:
+            await asyncio.sleep(0.05)
+
+    async def shutdown(self, reason: str = 'requested', from_command: bool = False):
+        """
+        Shuts the bot down. Prefer :meth:`begin`, which makes sure this only runs once.
+
+        :param reason: why the bot is shutting down
+        :param from_command: True if called from a command, which then isn't waited for
+        """
+        deadline = time.monotonic() + self.deadline
+        self.accepting = False
+        print(f'Shutting down ({reason}), deadline is {self.deadline:g} seconds...')
+        await self._drain(1 if from_command else 0, min(self.drain_timeout, self.deadline))
+        if self.in_flight > (1 if from_command else 0):
+            print(f'{self.in_flight} commands still in flight, flushing anyway.', file=sys.stderr)
+
+        storages = list(self._storages.items())
+        for name, (_, stop) in storages:
+            if stop is not None:
+                stop()
+        tasks = [asyncio.ensure_future(flush(deadline)) for _, (flush, _) in storages]
+        if len(tasks) > 0:
+            await asyncio.wait(tasks, timeout=max(0.0, deadline - time.monotonic()))
+        for (name, _), task in zip(storages, tasks):
+            if not task.done():
+                print(f'[{name}] still writing when the deadline passed, state unknown.', file=sys.stderr)
+                continue
+            try:
+                persisted, not_persisted = task.result()
+            except Exception as e:
+                print(f'[{name}] flush failed: {e!r}', file=sys.stderr)
+                continue
+            print(f'[{name}] persisted {len(persisted)}: {", ".join(persisted)}')
+            if len(not_persisted) > 0:
+                print(f'[{name}] NOT persisted {len(not_persisted)}: {", ".join(not_persisted)}', file=sys.stderr)
+        await self.bot.close()
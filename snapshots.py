@@ -0,0 +1,113 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+from typing import Any, Dict, List, Optional
+
+MANIFEST_NAME = 'MANIFEST.json'
+MANIFEST_VERSION = 2
+
+
+class SnapshotSource:
+    """Point-in-time state of a storage service, captured on the event loop for :func:`write_snapshot`.
+
+    Stores whose cached contents differ from the disk are serialized when captured. The others are read from disk
+    while the snapshot is written, so the service must not write them until the snapshot is done.
+    """
+
+    def __init__(self, name: str, root: str, cached: Dict[str, bytes], disk: Optional[List[str]] = None,
+                 changed: Optional[set] = None):
+        """
+        :param name: name of the service, used as the directory of its stores in the archive
+        :param root: directory the service stores its data in
+        :param cached: path (relative to root) -> serialized contents of each store captured from the cache, or None
+        if the store is being removed
+        :param disk: paths (relative to root) of the stores to read from disk (recorded as removed if they don't
+        exist). if None, reads every store on disk
+        :param changed: keys of the stores that changed since the previous snapshot, for the service to restore if the
+        snapshot fails
+        """
+        self.name = name
+        self.root = root
+        self.cached = cached
+        self.disk = disk
+        self.changed = changed
+
+
+def _list_stores(root: str) -> List[str]:
+    stores = []
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            if not file_name.endswith(('.json', '.json.gz')):
+                # skips temporary files of stores being written
+                continue
+            stores.append(os.path.relpath(os.path.join(dir_path, file_name), root).replace(os.sep, '/'))
+    return sorted(stores)
+
+
+def _add(archive: tarfile.TarFile, name: str, data: bytes, mtime: float):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    archive.addfile(info, io.BytesIO(data))
+
+
+def write_snapshot(file_name: str, sources: List[SnapshotSource], incremental: bool = False,
+                   base: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Writes a snapshot archive (a gzipped tarball), with a manifest as its last member.
+
+    Stores are streamed into the archive one at a time. The archive is written to a temporary file first, so
+    ``file_name`` only ever holds a complete snapshot. Incremental snapshots list the stores removed since the base
+    snapshot under ``deleted`` in the manifest.
+
+    :param file_name: file to write the snapshot to
+    :param sources: captured state of each storage service
+    :param incremental: True if the sources only hold the stores that changed since the base snapshot
+    :param base: name of the snapshot an incremental snapshot builds on
+    :return: the manifest
+    """
+    created = time.time()
+    manifest = dict(version=MANIFEST_VERSION, created=created, incremental=incremental, base=base, stores=dict(),
+                    deleted=dict())
+    temp_file = f'{file_name}.tmp'
+    f = open(temp_file, 'wb')
+    try:
+        archive = tarfile.open(fileobj=f, mode='w:gz')
+        for source in sources:
+            entries = manifest['stores'][source.name] = dict()
+            deleted = set()
+            for store, data in sorted(source.cached.items()):
+                if data is None:
+                    deleted.add(store)
+                    continue
+                _add(archive, f'{source.name}/{store}', data, created)
+                entries[store] = dict(size=len(data), sha256=hashlib.sha256(data).hexdigest(), origin='cache')
+            disk = _list_stores(source.root) if source.disk is None else sorted(source.disk)
+            for store in disk:
+                if store in source.cached:
+                    continue
+                try:
+                    store_file = open(os.path.join(source.root, store), 'rb')
+                except FileNotFoundError:
+                    deleted.add(store)
+                    continue
+                data = store_file.read()
+                store_file.close()
+                _add(archive, f'{source.name}/{store}', data, created)
+                entries[store] = dict(size=len(data), sha256=hashlib.sha256(data).hexdigest(), origin='disk')
+            if incremental:
+                manifest['deleted'][source.name] = sorted(deleted)
+        _add(archive, MANIFEST_NAME, json.dumps(manifest, indent=2).encode('utf-8'), created)
+        archive.close()
+        f.flush()
+        os.fsync(f.fileno())
+    except BaseException:
+        f.close()
+        os.remove(temp_file)
+        raise
+    f.close()
+    os.replace(temp_file, file_name)
+    return manifest
@@ -0,0 +1,62 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+
+class StartupReport:
+    """Records how long each phase of the bot's startup took."""
+
+    def __init__(self, origin: Optional[float] = None):
+        """
+        :param origin: :func:`time.perf_counter` value startup is measured from. if None, uses the current time
+        """
+        self.origin = time.perf_counter() if origin is None else origin
+        self.phases: List[Tuple[str, float]] = []
+        self.total = 0.0
+        self.finished = False
+
+    def record(self, name: str, seconds: float):
+        """
+        Records a phase.
+
+        :param name: phase name
+        :param seconds: time the phase took
+        """
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Context manager that records its duration as a phase.
+
+        :param name: phase name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def elapsed(self) -> float:
+        """
+        :return: time since startup began
+        """
+        return time.perf_counter() - self.origin
+
+    def lines(self) -> List[str]:
+        """
+        Formats the report.
+
+        :return: report lines
+        """
+        width = max((len(name) for name, _ in self.phases), default=0)
+        lines = [f'{name:<{width}}  {seconds * 1000:9.1f} ms' for name, seconds in self.phases]
+        if self.finished:
+            lines.append(f'{"total":<{width}}  {self.total * 1000:9.1f} ms')
+        return lines
+
+    def finish(self):
+        """Marks startup as finished, fixing the total time."""
+        if not self.finished:
+            self.total = self.elapsed()
+            self.finished = True
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import re
+from collections import namedtuple
+from random import Random
+from typing import Iterator, List, Optional
+
+from discord.ext import commands
+
+TRACE_HEADER = '# leobot-trace v1'
+
+_MENTION_PATTERN = re.compile(r'<@!?[0-9]+>$')
+
+TraceEvent = namedtuple('TraceEvent', 'delay command shapes scope user owner')
+TraceEvent.__doc__ = """A recorded command invocation.
+
+delay - time (in seconds) since the previous event arrived. may be negative, since events are recorded as their
+commands finish
+command - qualified name of the invoked command
+shapes - shape of each argument: "u" for users, "i" for integers and "s<length>" for anything else
+scope - "dm" for DMs, otherwise the hash of the guild
+user - hash of the invoking user
+owner - True if the invoking user owns the bot
+"""
+
+
+def arg_shape(token: str) -> str:
+    """
+    Describes the shape of a command argument without revealing its contents.
+
+    :param token: the argument
+    :return: "u" for user mentions and IDs, "i" for other integers and "s<length>" for anything else
+    """
+    if _MENTION_PATTERN.match(token) is not None or (token.isdigit() and len(token) >= 15):
+        return 'u'
+    if token.lstrip('-').isdigit():
+        return 'i'
+    return f's{len(token)}'
+
+
+class TraceRecorder:
+    """Records anonymized command invocations to a line-oriented trace file.
+
+    Each line holds an event's inter-arrival time (in milliseconds), command name, argument shapes, scope and user
+    hashes and owner flag, separated by tabs. IDs are hashed with a salt, so events can be linked to each other but
+    not to real users or guilds.
+    """
+
+    def __init__(self, file_name: str, salt: Optional[str] = None):
+        """
+        :param file_name: trace file. events are appended to it
+        :param salt: salt for hashing IDs. if None, uses a random salt, so traces can't be linked to each other
+        """
+        self._salt = os.urandom(16).hex() if salt is None else salt
+        self._last_arrival = None
+        exists = os.path.exists(file_name)
+        self._file = open(file_name, 'a', buffering=1)
+        if not exists:
+            self._file.write(TRACE_HEADER + '\n')
+
+    def _hash(self, value: int) -> str:
+        return hashlib.blake2b(f'{self._salt}:{value}'.encode('utf-8'), digest_size=4).hexdigest()
+
+    def record(self, ctx: commands.Context, arrival: float):
+        """
+        Records a command invocation.
+
+        :param ctx: context of the invocation
+        :param arrival: :func:`time.perf_counter` value from when the invocation arrived
+        """
+        if self._file is None or ctx.command is None:
+            return
+        delay = 0.0 if self._last_arrival is None else arrival - self._last_arrival
+        self._last_arrival = arrival
+        tokens = ctx.message.content[len(ctx.prefix or ''):].split()
+        # skip the command's name (and its parents' names)
+        shapes = ','.join(arg_shape(token) for token in tokens[len(ctx.command.qualified_name.split()):])
+        scope = 'dm' if ctx.guild is None else self._hash(ctx.guild.id)
+        owner = ctx.author.id == ctx.bot.owner_id or ctx.author.id in (ctx.bot.owner_ids or ())
+        self._file.write(f'{round(delay * 1000)}\t{ctx.command.qualified_name}\t{shapes}\t{scope}\t'
+                         f'{self._hash(ctx.author.id)}\t{int(owner)}\n')
+
+    def close(self):
+        """Closes the trace file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_trace(file_name: str) -> Iterator[TraceEvent]:
+    """
+    Reads a trace file.
+
+    :param file_name: trace file
+    :return: the trace's events, in the order they were recorded
+    """
+    f = open(file_name, 'r')
+    try:
+        for line in f:
+            if line.startswith('#') or line.strip() == '':
+                continue
+            delay, command, shapes, scope, user, owner = line.rstrip('\n').split('\t')
+            yield TraceEvent(int(delay) / 1000, command, [] if shapes == '' else shapes.split(','), scope, user,
+                             owner == '1')
+    finally:
+        f.close()
+
+
+def synthesize_args(shapes: List[str], rng: Random, user_ids: List[int]) -> str:
+    """
+    Makes up arguments matching recorded shapes.
+
+    :param shapes: shapes of the arguments
+    :param rng: random number generator to use
+    :param user_ids: IDs to pick users from
+    :return: the arguments, separated by spaces
+    """
+    args = []
+    for shape in shapes:
+        if shape == 'u':
+            args.append(f'<@{rng.choice(user_ids)}>')
+        elif shape == 'i':
+            args.append(str(rng.randint(1, 10)))
+        else:
+            args.append('x' * max(1, int(shape[1:])))
+    return ' '.join(args)
+
+
+def arrival_offsets(events: List[TraceEvent]) -> List[float]:
+    """
+    Converts events' inter-arrival times to offsets from the first event.
+
+    :param events: the events
+    :return: offset (in seconds) of each event
+    """
+    offsets = []
+    offset = 0.0
+    for event in events:
+        offset += event.delay
+        offsets.append(offset)
+    start = min(offsets, default=0.0)
+    return [o - start for o in offsets]
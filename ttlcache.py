@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A bounded mapping whose entries expire after a fixed amount of time.
+
+    When the cache is full, the least recently written entry is evicted to make room for a new one.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        """
+        :param ttl: time (in seconds) an entry stays valid after being set
+        :param maxsize: maximum amount of entries kept at once
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Retrieves an entry from the cache.
+
+        :param key: key of the entry
+        :param default: value to return if the entry doesn't exist or has expired
+        :return: value of the entry, or default
+        """
+        entry: Optional[Tuple[float, Any]] = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Stores an entry in the cache.
+
+        :param key: key of the entry
+        :param value: value of the entry
+        :param ttl: time (in seconds) the entry stays valid. if None, uses the cache's default TTL
+        """
+        if key in self._entries:
+            del self._entries[key]
+        elif len(self._entries) >= self.maxsize:
+            self.prune()
+            while len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Removes an entry from the cache.
+
+        :param key: key of the entry
+        :param default: value to return if the entry doesn't exist or has expired
+        :return: value of the removed entry, or default
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        del self._entries[key]
+        return value
+
+    def prune(self) -> int:
+        """
+        Removes all expired entries from the cache.
+
+        :return: amount of entries removed
+        """
+        now = time.monotonic()
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+        return len(expired)
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        self._entries.clear()